@@ -0,0 +1,122 @@
+# Compares the size and parse time of the grouped hitta data in the
+# plain and the compact form (process.py build --compact) on a synthetic
+# catalog, and checks that the compact form decodes to the same rows,
+# which get their group's coords.
+# JSON.parse and decodeHitta are timed in node, if it's installed.
+#
+#   python benchmarks/bench_compact.py --scale 10
+
+import argparse
+import gzip
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+import process  # noqa: E402
+from export import decode_compact, encode_compact  # noqa: E402
+from suite import synthetic_rows  # noqa: E402
+
+DECODER_PATH = os.path.join(ROOT, "vastgotalatar", "src", "hitta.js")
+
+NODE_SCRIPT = """
+const fs = require('fs');
+import(process.argv[1]).then(({ decodeHitta }) => {
+    for (const path of process.argv.slice(2)) {
+        const text = fs.readFileSync(path, 'utf8');
+        let parse = Infinity;
+        let total = Infinity;
+        for (let i = 0; i < 20; i++) {
+            const t = process.hrtime.bigint();
+            const data = JSON.parse(text);
+            const parsed = process.hrtime.bigint();
+            decodeHitta(data);
+            parse = Math.min(parse, Number(parsed - t) / 1e6);
+            total = Math.min(total, Number(process.hrtime.bigint() - t) / 1e6);
+        }
+        console.log(parse.toFixed(1), total.toFixed(1));
+    }
+});
+"""
+
+
+def grouped_rows(scale):
+    rng = random.Random(0)
+    rows = synthetic_rows(scale)
+    for row in rows:
+        row["coords"] = [(rng.uniform(57.3, 59.3), rng.uniform(11.3, 14.3))]
+        row["filter"] = process.get_filter(row)
+    grouped, _ = process.group_rows(rows, [process.row_hash(r) for r in rows])
+    # as the rows are read back from hitta.json
+    return json.loads(json.dumps(grouped))
+
+
+def best_time(fn, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        t = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scale", type=int, default=10)
+    args = parser.parse_args()
+
+    grouped = grouped_rows(args.scale)
+    compact = encode_compact(grouped)
+    plain_raw = json.dumps(grouped, ensure_ascii=False, separators=(",", ":"))
+    compact_raw = json.dumps(compact, ensure_ascii=False, separators=(",", ":"))
+
+    rows = sum(len(g["rows"]) for g in grouped.values())
+    print(f"{rows} rows in {len(grouped)} groups ({args.scale}x catalog)")
+    for name, raw in [("plain", plain_raw), ("compact", compact_raw)]:
+        data = raw.encode()
+        parse = best_time(lambda: json.loads(raw))
+        print(
+            f"{name:8} {len(data) / 1024:8.0f} KiB"
+            f"  gzip {len(gzip.compress(data)) / 1024:6.0f} KiB"
+            f"  json.loads {parse * 1000:6.1f} ms"
+        )
+    decode = best_time(lambda: decode_compact(json.loads(compact_raw)))
+    print(f"json.loads + decode_compact {decode * 1000:.1f} ms")
+
+    if shutil.which("node"):
+        with tempfile.TemporaryDirectory() as tmp:
+            paths = []
+            for name, raw in [("plain", plain_raw), ("compact", compact_raw)]:
+                paths.append(os.path.join(tmp, f"{name}.json"))
+                with open(paths[-1], "w") as f:
+                    f.write(raw)
+            out = subprocess.check_output(
+                ["node", "--no-warnings", "-e", NODE_SCRIPT, DECODER_PATH, *paths],
+                text=True,
+            ).split()
+        print(f"node JSON.parse:               {out[0]} -> {out[2]} ms")
+        print(f"node JSON.parse + decodeHitta: {out[1]} -> {out[3]} ms")
+
+    expected = {
+        key: {
+            **group,
+            "rows": [{**row, "coords": group["coords"]} for row in group["rows"]],
+        }
+        for key, group in grouped.items()
+    }
+    identical = decode_compact(compact) == expected
+    print(f"identical: {identical}")
+    if not identical:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+# Compares per-row get_filter against the column-wise get_filters on the
+# catalog repeated N times, and checks that the output is identical.
+#
+#   python benchmarks/bench_filters.py --scale 100
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd  # noqa: E402
+
+import process  # noqa: E402
+
+
+def timed(fn, arg):
+    process.normalize_instrument.cache_clear()
+    t = time.perf_counter()
+    result = fn(arg)
+    return result, time.perf_counter() - t
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scale", type=int, default=100)
+    args = parser.parse_args()
+
+    df = process.load_hitta_df()
+    df = pd.concat([df] * args.scale, ignore_index=True)
+    print(f"{len(df)} rows ({args.scale}x catalog)")
+
+    rows = process.load_hitta_rows(df)
+    expected, row_time = timed(lambda rows: [process.get_filter(r) for r in rows], rows)
+    actual, column_time = timed(process.get_filters, df)
+
+    identical = json.dumps(expected, ensure_ascii=False) == json.dumps(
+        actual, ensure_ascii=False
+    )
+    print(f"per row:     {row_time:.3f} s")
+    print(f"column-wise: {column_time:.3f} s ({row_time / column_time:.1f}x)")
+    print(f"identical:   {identical}")
+    if not identical:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
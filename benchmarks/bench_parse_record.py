@@ -0,0 +1,71 @@
+# Compares the per-field CSS selectors that parse_record used to run
+# against the single-pass parse_record_table on the saved record page,
+# and checks that the fields are identical.
+#
+#   python benchmarks/bench_parse_record.py --repeat 2000
+
+import argparse
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "visarkiv"))
+
+from scrapy.http import HtmlResponse  # noqa: E402
+
+from visarkiv.parsing import RECORD_FIELDS, parse_record_table  # noqa: E402
+
+PAGE_PATH = os.path.join(ROOT, "visarkiv", "item-page.html")
+
+
+def parse_per_field(response):
+    def extract_field(fieldname):
+        selector = f'tr[id="{fieldname}"] td.fieldContents div::text'
+        return "".join(response.css(selector).getall()).strip()
+
+    fields = {name: extract_field(row_id) for name, row_id in RECORD_FIELDS.items()}
+    media_url = response.css('tr[id="XRMED"] audio::attr(src)').get()
+    return fields, media_url
+
+
+def parse_single_pass(response):
+    return parse_record_table(response.selector.root)
+
+
+# Every round parses a fresh response, as the spider does, so document
+# parsing is included in both timings.
+def timed(fn, body, repeat):
+    t = time.perf_counter()
+    for _ in range(repeat):
+        response = HtmlResponse("https://katalog.visarkiv.se/", body=body)
+        result = fn(response)
+    return result, (time.perf_counter() - t) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+
+    with open(PAGE_PATH, "rb") as f:
+        body = f.read()
+
+    _, parse_time = timed(lambda response: response.selector.root, body, args.repeat)
+    expected, field_time = timed(parse_per_field, body, args.repeat)
+    actual, single_time = timed(parse_single_pass, body, args.repeat)
+
+    print(f"document parse:  {parse_time * 1e6:8.0f} µs/record")
+    print(f"per-field CSS:   {field_time * 1e6:8.0f} µs/record")
+    print(f"single pass:     {single_time * 1e6:8.0f} µs/record")
+    print(
+        f"selectors alone: {(field_time - parse_time) * 1e6:.0f} -> "
+        f"{(single_time - parse_time) * 1e6:.0f} µs/record"
+    )
+    print(f"identical: {expected == actual}")
+    if expected != actual:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
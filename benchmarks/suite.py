@@ -0,0 +1,494 @@
+# Benchmarks the hot paths of process.py and the spider on synthetic
+# catalogs scaled 1x, 10x and 100x. Geocoding goes through a fake,
+# in-process geocoder and a throwaway cache, so no API key or network is
+# needed, and the spider parses the saved record page.
+#
+# Throughput (best of --repeat runs) and peak traced memory (one more
+# run under tracemalloc) are printed, and saved in
+# benchmarks/results/<commit>.json, so that a later run can be compared
+# with an earlier commit:
+#
+#   python benchmarks/suite.py
+#   python benchmarks/suite.py --scale 1 --scale 10 --only get_locations
+#   python benchmarks/suite.py --compare HEAD~1
+
+import argparse
+import contextlib
+import datetime
+import hashlib
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "visarkiv"))
+
+from geopy.location import Location  # noqa: E402
+
+import process  # noqa: E402
+from geocache import GeocodeCache  # noqa: E402
+
+try:
+    from scrapy.http import HtmlResponse, Request
+
+    from visarkiv.crawlstate import CrawlState
+    from visarkiv.spiders.visarkiv_spider import VisarkivSpider
+except ImportError:
+    HtmlResponse = None
+
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+PAGE_PATH = os.path.join(ROOT, "visarkiv", "item-page.html")
+
+# rows and record pages of the 1x catalog
+BASE_ROWS = 500
+BASE_RECORDS = 50
+
+# a change in time per item or peak memory beyond this is reported as
+# a regression by --compare
+THRESHOLD = 0.10
+
+
+PLACES = {
+    "Västergötland": [
+        "Vara", "Habo", "Falköping", "Skövde", "Lidköping", "Mariestad", "Hjo",
+        "Tidaholm", "Ulricehamn", "Borås", "Alingsås", "Vårgårda", "Herrljunga",
+        "Trollhättan", "Vänersborg", "Grästorp", "Essunga", "Götene", "Tibro",
+        "Karlsborg", "Töreboda", "Gullspång", "Bollebygd", "Tranemo", "Svenljunga",
+    ],
+    "Bohuslän": [
+        "Uddevalla", "Kungälv", "Strömstad", "Tanum", "Sotenäs", "Lysekil",
+        "Orust", "Tjörn", "Stenungsund", "Munkedal", "Öckerö",
+    ],
+    "Dalsland": ["Åmål", "Bengtsfors", "Mellerud", "Dals-Ed", "Färgelanda"],
+}
+VILLAGE_SUFFIXES = ["by", "torp", "backen", "berg", "näs", "red", "hult", "kulla"]
+PROVENIENS_NOTES = ["textbok", "lösblad", "CD", "m.m.", "VHS"]
+
+INSTRUMENTS = [
+    "fiol", "fioler", "fiol 1", "fiol 2", "sång", "sång (kvinna)", "nyckelharpa",
+    "klarinett", "2-radigt dragspel", "durspel", "cittra", "flöjt", "munspel",
+    "m.m", "-", "piano", "orgel", "gitarr",
+]
+SONG_TYPES = [
+    "Polska", "Vals", "Vals, brudmarsch", "Schottis", "Visa, skillingtryck",
+    "Polka (hambo)", "Marsch", "Engelska", "Psalm", "Hambo?", "Gånglåt",
+    "Visa, ballad, vallvisa", "",
+]
+COLLECTORS = [
+    "Josefsson, Arnold, Djupedal, Vara", "Nordström, Annika (Olsson, Elsa, ev.)",
+    "Lätt, Billy, Korsberga, Hjo", "Adin, Björn, Skövde", "Adin, Björn",
+    "Andersson, Nils", "Hellström, Gunnar", "Sahlström, Eric", "Ek, Ivar",
+    "Hedlund, Kerstin", None,
+]
+FIRST_NAMES = ["Anna", "Karl", "Emil", "Johan", "Elsa", "Gustav", "Hilda", "Nils"]
+LAST_NAMES = ["Andersson", "Johansson", "Karlsson", "Nilsson", "Eriksson", "Larsson"]
+
+
+# Deterministic rows with the columns and the kinds of values of the
+# hitta catalog. The number of distinct places grows with the square
+# root of the size, as it does when a catalog grows.
+def synthetic_rows(scale, seed=0):
+    rng = random.Random(seed)
+    n_rows = BASE_ROWS * scale
+    n_villages = 2 + round(2 * scale**0.5)
+    villages = {
+        ls: towns
+        + [village(town, i) for town in towns for i in range(n_villages)]
+        for ls, towns in PLACES.items()
+    }
+
+    rows = []
+    for i in range(n_rows):
+        ls = rng.choices(list(villages), weights=[6, 2, 1])[0]
+        prov, landskap = synthetic_proveniens(rng, villages, ls)
+        name = f"{rng.choice(LAST_NAMES)}, {rng.choice(FIRST_NAMES)}"
+        rows.append(
+            {
+                "Acc.nr": f"VG{i:07d}",
+                "Låt nr": rng.randint(1, 30),
+                "Titel eller låtnamn": f"{rng.choice(SONG_TYPES[:8]) or 'Låt'}"
+                f" efter {name.split(',')[0]}",
+                "Låttyp eller visgenre": rng.choice(SONG_TYPES) or None,
+                "Sång  instrument": ", ".join(
+                    rng.sample(INSTRUMENTS, rng.choice([1, 1, 1, 2, 3]))
+                ),
+                "Sångare,  Instrumentalist, namn": name,
+                "Född år": rng.randint(1850, 1960),
+                "Inspelat/ inlämnat av": rng.choice(COLLECTORS),
+                "Inspelat/nedtecknat år": rng.randint(1900, 2000),
+                "Inspelat år": None,
+                "Inspelat år.1": None,
+                "Proveniens": prov,
+                "Landskap": landskap,
+                "Övrigt": None,
+            }
+        )
+    return rows
+
+
+# "Vara", "Varaby", ..., "Varakulla", "Varaby 2", ...
+def village(town, i):
+    suffix = VILLAGE_SUFFIXES[i % len(VILLAGE_SUFFIXES)]
+    number = i // len(VILLAGE_SUFFIXES)
+    return f"{town}{suffix} {number + 1}" if number else f"{town}{suffix}"
+
+
+# The shapes of Proveniens that take different paths in get_locations
+def synthetic_proveniens(rng, villages, ls):
+    kind = rng.random()
+    places = villages[ls]
+    if kind < 0.02:
+        return None, ls
+    if kind < 0.55:
+        return rng.choice(places), ls
+    if kind < 0.70:
+        return ", ".join(rng.sample(places, 2)), ls
+    if kind < 0.78:
+        return ", ".join(rng.sample(places, 4)), ls
+    if kind < 0.86:
+        note = rng.choice(["by", "gård", "ev."])
+        return f"{rng.choice(places)} ({note}), {rng.choice(places)}", ls
+    if kind < 0.93:
+        return f"{rng.choice(places)}, {rng.choice(PROVENIENS_NOTES)}", ls
+    other = rng.choice([o for o in villages if o != ls])
+    prov = f"{rng.choice(places)}, {rng.choice(villages[other])}"
+    return prov, f"{ls}, {other}"
+
+
+# Stands in for geopy.GoogleV3: every query gets the same one or two
+# candidates in the region on every run, and some get none.
+class FakeGeocoder:
+    def __init__(self, miss_rate=0.05):
+        self.miss_rate = miss_rate
+        self.calls = 0
+
+    def geocode(self, query, exactly_one=False, bounds=None):
+        self.calls += 1
+        rng = random.Random(hashlib.sha1(query.encode()).digest())
+        if rng.random() < self.miss_rate:
+            return []
+        return [
+            Location(
+                query,
+                (rng.uniform(57.3, 59.3), rng.uniform(11.3, 14.3)),
+                {"types": ["locality", "political"]},
+            )
+            for _ in range(rng.choice([1, 1, 2]))
+        ]
+
+
+class Catalog:
+    def __init__(self, scale, tmp_dir):
+        self.scale = scale
+        self.rows = synthetic_rows(scale)
+        self.geocoder = FakeGeocoder()
+        self.cache = GeocodeCache(os.path.join(tmp_dir, f"geocode-{scale}.db"))
+        self._df = None
+
+    @property
+    def df(self):
+        import pandas as pd
+
+        if self._df is None:
+            self._df = pd.DataFrame(self.rows)
+        return self._df
+
+    @contextlib.contextmanager
+    def geocoding(self):
+        get_cache, get_geocoder = process.get_cache, process.get_geocoder
+        process.get_cache = lambda: self.cache
+        process.get_geocoder = lambda: self.geocoder
+        try:
+            yield
+        finally:
+            process.get_cache, process.get_geocoder = get_cache, get_geocoder
+
+    def prefetch(self):
+        process.prefetch_locations(self.rows, geocoder=self.geocoder, rate=1e9)
+
+
+BENCHMARKS = {}
+
+
+# A benchmark takes a catalog and returns the number of items it
+# processes and the function to time. Setup outside that function isn't
+# measured.
+def benchmark(name):
+    def register(fn):
+        BENCHMARKS[name] = fn
+        return fn
+
+    return register
+
+
+@benchmark("cleanup_parens_parts")
+def bench_cleanup_parens_parts(catalog):
+    parts = [
+        process.split(process.cleanup_proveniens(row["Proveniens"]))
+        for row in catalog.rows
+        if row["Proveniens"]
+    ]
+    return len(parts), lambda: [process.cleanup_parens_parts(p) for p in parts]
+
+
+@benchmark("normalize_instrument")
+def bench_normalize_instrument(catalog):
+    parts = [
+        process.normalize_string(p)
+        for row in catalog.rows
+        for p in row["Sång  instrument"].split(",")
+    ]
+
+    def run():
+        process.normalize_instrument.cache_clear()
+        return [process.normalize_instrument(p) for p in parts]
+
+    return len(parts), run
+
+
+@benchmark("get_filter")
+def bench_get_filter(catalog):
+    def run():
+        process.normalize_instrument.cache_clear()
+        return [process.get_filter(row) for row in catalog.rows]
+
+    return len(catalog.rows), run
+
+
+@benchmark("get_filters")
+def bench_get_filters(catalog):
+    df = catalog.df
+
+    def run():
+        process.normalize_instrument.cache_clear()
+        return process.get_filters(df)
+
+    return len(catalog.rows), run
+
+
+# cache misses resolved through the fake geocoder into a fresh cache
+@benchmark("prefetch_locations")
+def bench_prefetch_locations(catalog):
+    def run():
+        catalog.cache.invalidate()
+        with catalog.geocoding():
+            catalog.prefetch()
+
+    return len(catalog.rows), run
+
+
+# every lookup is a cache hit, as in a build after prefetching
+@benchmark("get_locations")
+def bench_get_locations(catalog):
+    with catalog.geocoding():
+        catalog.prefetch()
+
+    def run():
+        with catalog.geocoding():
+            return [
+                process.get_locations(row["Proveniens"], row["Landskap"])
+                for row in catalog.rows
+            ]
+
+    return len(catalog.rows), run
+
+
+# hashing and grouping the finished rows, as create_hitta_data does
+@benchmark("group_rows")
+def bench_group_rows(catalog):
+    rng = random.Random(0)
+    rows = [
+        {**row, "coords": [(rng.uniform(57.3, 59.3), rng.uniform(11.3, 14.3))]}
+        for row in catalog.rows
+    ]
+    for row in rows:
+        row["filter"] = process.get_filter(row)
+
+    def run():
+        hashes = [process.row_hash(row) for row in rows]
+        return process.group_rows(rows, hashes)
+
+    return len(rows), run
+
+
+@benchmark("parse_record")
+def bench_parse_record(catalog):
+    if HtmlResponse is None:
+        return None
+
+    with open(PAGE_PATH, "rb") as f:
+        body = f.read()
+    n = BASE_RECORDS * catalog.scale
+    state_dir = tempfile.mkdtemp()
+
+    def run():
+        spider = VisarkivSpider()
+        spider.state = CrawlState(os.path.join(state_dir, "crawlstate.json"))
+        # as if the hit list had listed n records on its first page
+        spider.listed = {"Västergötland": 1}
+        spider.pending = defaultdict(Counter, {"Västergötland": Counter({1: n})})
+        for i in range(n):
+            url = f"https://katalog.visarkiv.se/lib/views/rec/record{i}"
+            meta = {
+                "landscape": "Västergötland",
+                "page": 1,
+                "accessionsnummer": f"SVA BA {i:04d}",
+            }
+            response = HtmlResponse(url, body=body, request=Request(url, meta=meta))
+            list(spider.parse_record(response))
+
+    return n, run
+
+
+def measure(run, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        t = time.perf_counter()
+        run()
+        best = min(best, time.perf_counter() - t)
+
+    tracemalloc.start()
+    try:
+        run()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return best, peak
+
+
+def commit():
+    try:
+        sha = subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True
+        ).strip()
+        dirty = subprocess.run(
+            ["git", "diff", "--quiet", "HEAD"], cwd=ROOT
+        ).returncode
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown", False
+    return sha, bool(dirty)
+
+
+def resolve(rev):
+    if os.path.exists(rev):
+        return rev
+    sha = subprocess.check_output(
+        ["git", "rev-parse", "--short", rev], cwd=ROOT, text=True
+    ).strip()
+    return os.path.join(RESULTS_DIR, f"{sha}.json")
+
+
+# Results of earlier runs on the same commit are kept, so that partial
+# runs (--only, --scale) add up.
+def save_results(results):
+    sha, dirty = commit()
+    path = os.path.join(RESULTS_DIR, f"{sha}.json")
+    try:
+        with open(path) as f:
+            saved = json.load(f)
+    except FileNotFoundError:
+        saved = {"commit": sha, "results": {}}
+
+    saved.update(
+        dirty=dirty,
+        date=datetime.datetime.now().isoformat(timespec="seconds"),
+        python=platform.python_version(),
+    )
+    for name, scales in results.items():
+        saved["results"].setdefault(name, {}).update(scales)
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(saved, f, indent=1)
+    return path
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"\ncompared with {baseline['commit']} ({baseline['date']})")
+
+    regressions = 0
+    for name, scales in results.items():
+        for scale, result in scales.items():
+            old = baseline["results"].get(name, {}).get(scale)
+            if not old:
+                continue
+            time_change = result["us_per_item"] / old["us_per_item"] - 1
+            peak_change = (result["peak_kb"] + 1) / (old["peak_kb"] + 1) - 1
+            regressed = time_change > THRESHOLD or peak_change > THRESHOLD
+            regressions += regressed
+            print(
+                f"{name:22} {scale:>4}x  time {time_change:+7.1%}"
+                f"  peak {peak_change:+7.1%}{'  REGRESSION' if regressed else ''}"
+            )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--scale", type=int, action="append", help="catalog scale (default 1, 10, 100)"
+    )
+    parser.add_argument(
+        "--only", action="append", choices=sorted(BENCHMARKS), help="benchmark to run"
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--compare", metavar="REV", help="commit (or results file) to compare with"
+    )
+    parser.add_argument("--no-save", action="store_true")
+    args = parser.parse_args()
+
+    baseline_path = resolve(args.compare) if args.compare else None
+    if baseline_path and not os.path.exists(baseline_path):
+        sys.exit(f"no saved results for {args.compare}: {baseline_path}")
+
+    # load the landskap polygons and bounds up front, so that the first
+    # benchmark to geocode doesn't pay for them
+    process.get_landskap()
+    process.get_bounds()
+
+    results = defaultdict(dict)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for scale in args.scale or [1, 10, 100]:
+            catalog = Catalog(scale, tmp_dir)
+            for name in args.only or BENCHMARKS:
+                setup = BENCHMARKS[name](catalog)
+                if setup is None:
+                    print(f"{name:22} {scale:>4}x  skipped (scrapy isn't installed)")
+                    continue
+                items, run = setup
+                seconds, peak = measure(run, args.repeat)
+                results[name][str(scale)] = result = {
+                    "items": items,
+                    "seconds": round(seconds, 6),
+                    "items_per_second": round(items / seconds),
+                    "us_per_item": round(seconds / items * 1e6, 3),
+                    "peak_kb": round(peak / 1024),
+                }
+                print(
+                    f"{name:22} {scale:>4}x  {items:>8} items"
+                    f"  {result['seconds']:9.3f} s"
+                    f"  {result['items_per_second']:>10}/s"
+                    f"  peak {result['peak_kb']:>8} KiB"
+                )
+            catalog.cache.close()
+
+    if not args.no_save:
+        print(f"saved {save_results(results)}")
+
+    if baseline_path and compare(results, baseline_path):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+import math
+import os
+from collections import Counter
+
+from export import write_json
+from facets import FACETS
+from spatial import SpatialHash
+
+
+# zoom levels of the map in TuneMap.js; from MAX_ZOOM on every group is
+# drawn on its own
+MIN_ZOOM = 6
+MAX_ZOOM = 15
+
+# cluster radius in pixels of a 256px tile
+RADIUS = 40
+TILE_PX = 256
+
+TOP_FACETS = 3
+
+
+# A group with several coords is several points, so clusters keep the
+# set of group keys they contain and counts are summed over that.
+class Cluster:
+    def __init__(self, x, y, points, keys):
+        self.x = x
+        self.y = y
+        self.points = points
+        self.keys = keys
+
+
+def lng_to_x(lng):
+    return lng / 360 + 0.5
+
+
+def lat_to_y(lat):
+    sin = math.sin(math.radians(lat))
+    y = 0.5 - 0.25 * math.log((1 + sin) / (1 - sin)) / math.pi
+    return min(max(y, 0), 1)
+
+
+def x_to_lng(x):
+    return (x - 0.5) * 360
+
+
+def y_to_lat(y):
+    return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y))))
+
+
+# The rows of a group per value of each facet of facets.json
+def group_facets(group):
+    facets = {name: Counter() for name in FACETS}
+    for row in group["rows"]:
+        filt = row.get("filter")
+        for name, values_of in FACETS.items():
+            values = dict.fromkeys(values_of(filt) if filt else [])
+            facets[name].update(value for value in values if value)
+    return facets
+
+
+# Greedy clustering in the style of supercluster: every point not yet
+# taken absorbs the untaken points within the zoom level's radius, and
+# the result is the input of the next level down.
+def cluster_level(points, zoom):
+    r = RADIUS / (TILE_PX * 2**zoom)
+    grid = SpatialHash(r)
+    for i, p in enumerate(points):
+        grid.insert(p.x, p.y, i)
+
+    taken = [False] * len(points)
+    clusters = []
+    for i, p in enumerate(points):
+        if taken[i]:
+            continue
+        taken[i] = True
+        members = [p]
+        for _, _, j in grid.near(p.x, p.y, r):
+            if not taken[j]:
+                taken[j] = True
+                members.append(points[j])
+        clusters.append(merge(members))
+
+    return clusters
+
+
+def merge(members):
+    if len(members) == 1:
+        return members[0]
+
+    points = sum(m.points for m in members)
+    return Cluster(
+        sum(m.x * m.points for m in members) / points,
+        sum(m.y * m.points for m in members) / points,
+        points,
+        frozenset().union(*[m.keys for m in members]),
+    )
+
+
+def build_clusters(grouped):
+    points = []
+    for key in sorted(grouped):
+        for lat, lng in grouped[key]["coords"]:
+            x, y = lng_to_x(lng), lat_to_y(lat)
+            points.append(Cluster(x, y, 1, frozenset([key])))
+
+    levels = {}
+    for zoom in range(MAX_ZOOM - 1, MIN_ZOOM - 1, -1):
+        points = cluster_level(points, zoom)
+        levels[zoom] = points
+    return levels
+
+
+# One file per zoom level, with a row per cluster:
+#
+#   [lat, lng, rows, groups, group key or null,
+#    {"primary_type": [["Polska", 12], ...], "secondary_type": [...],
+#     "instrument": [...], "collector": [...]}]
+def write_clusters(grouped, out_dir):
+    os.makedirs(out_dir, exist_ok=True)
+    facets = {key: group_facets(group) for key, group in grouped.items()}
+
+    for zoom, clusters in build_clusters(grouped).items():
+        level = []
+        for c in clusters:
+            keys = sorted(c.keys)
+            cluster_facets = {name: Counter() for name in FACETS}
+            for key in keys:
+                for name in FACETS:
+                    cluster_facets[name].update(facets[key][name])
+            level.append(
+                [
+                    round(y_to_lat(c.y), 5),
+                    round(x_to_lng(c.x), 5),
+                    sum(len(grouped[key]["rows"]) for key in keys),
+                    len(keys),
+                    keys[0] if len(keys) == 1 else None,
+                    {
+                        name: counter.most_common(TOP_FACETS)
+                        for name, counter in cluster_facets.items()
+                    },
+                ]
+            )
+        write_json(os.path.join(out_dir, f"z{zoom}.json"), level)
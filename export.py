@@ -0,0 +1,224 @@
+import gzip
+import json
+import math
+import os
+import re
+
+import text
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# degrees
+TILE_SIZE = 0.25
+
+
+# Writes data as JSON together with precompressed .gz and .br copies,
+# for servers that can serve them directly (e.g. nginx gzip_static and
+# brotli_static). The .br copy is skipped if brotli isn't installed.
+# Files the map doesn't fetch aren't compressed, and copies of them left
+# by earlier builds are removed.
+def write_json(path, data, compress=True):
+    raw = json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode()
+    with open(path, "wb") as f:
+        f.write(raw)
+    if not compress:
+        for copy in [path + ".gz", path + ".br"]:
+            if os.path.exists(copy):
+                os.remove(copy)
+        return
+    with open(path + ".gz", "wb") as f:
+        f.write(gzip.compress(raw, compresslevel=9, mtime=0))
+    if brotli is not None:
+        with open(path + ".br", "wb") as f:
+            f.write(brotli.compress(raw, quality=11))
+
+
+def slugify(s):
+    return re.sub(r"[^a-z0-9]+", "-", text.fold(s)).strip("-") or "none"
+
+
+def shard_name(key, group, shard_by):
+    if shard_by == "landskap":
+        return slugify(key.split(" | ")[-1])
+
+    if not group["coords"]:
+        return "none"
+    lat, lng = group["coords"][0]
+    return f"tile-{math.floor(lat / TILE_SIZE)}-{math.floor(lng / TILE_SIZE)}"
+
+
+# Splits the grouped rows into shards by landskap or by a TILE_SIZE grid
+# and writes a small index with each group's coords, row count and
+# shard, which is all the map needs for its first paint:
+#
+#   {"shards": ["tile-233-50.json", ...],
+#    "groups": [["Källby | Västergötland", [[58.5, 13.1]], 12, 0], ...]}
+def write_sharded(grouped, out_dir, shard_by="tile", compact=False):
+    os.makedirs(out_dir, exist_ok=True)
+    for name in os.listdir(out_dir):
+        if re.search(r"\.json(\.gz|\.br)?$", name):
+            os.remove(os.path.join(out_dir, name))
+
+    shards = {}
+    index = []
+    for key, group in grouped.items():
+        name = shard_name(key, group, shard_by) + ".json"
+        shard = shards.setdefault(name, {})
+        shard[key] = group
+        index.append([key, group["coords"], len(group["rows"]), name])
+
+    names = list(shards)
+    shard_idx = {name: i for i, name in enumerate(names)}
+    for entry in index:
+        entry[3] = shard_idx[entry[3]]
+
+    for name, shard in shards.items():
+        if compact:
+            shard = encode_compact(shard)
+        write_json(os.path.join(out_dir, name), shard)
+    write_json(os.path.join(out_dir, "index.json"), {"shards": names, "groups": index})
+
+
+# A column is interned if it has at most this many distinct values per
+# value, e.g. landskap, collectors, genres and the filters derived from
+# them
+INTERN_RATIO = 0.5
+
+# about 1 m
+COORD_DECIMALS = 5
+
+# columns per word of a row's presence mask, so that the frontend can
+# test them with 32-bit bitwise operations
+MASK_BITS = 32
+
+
+def round_coords(coords):
+    return [[round(c, COORD_DECIMALS) for c in point] for point in coords]
+
+
+# The compact form of grouped rows. Column names are listed once, and
+# the values of repetitive columns are stored once per column. A
+# column whose values are objects (the filter) is split into one
+# column per key. Rows don't repeat their group's coords, which are
+# rounded to COORD_DECIMALS. Each row is an array: a mask of the
+# columns it has a value for (None is left out), in as many words of
+# MASK_BITS columns as there are columns, then those values in column
+# order, as indices into the column's table if it has one:
+#
+#   {"format": "compact-1",
+#    "columns": ["Acc.nr", ..., "Landskap", ..., ["filter", "collector"]],
+#    "values": [null, ..., ["Västergötland", "Bohuslän"], ..., ["Adin, Björn"]],
+#    "groups": {"Källby | Västergötland": {"coords": [[58.5, 13.1]],
+#                                          "rows": [[16399, "VG 1", 0, ...]]}}}
+#
+# Each table is sorted by frequency, so the common values get the short
+# indices. decode_compact (and decodeHitta in the frontend) turns this
+# back into grouped rows.
+def encode_compact(grouped):
+    rows = [row for group in grouped.values() for row in group["rows"]]
+
+    columns = {}
+    for row in rows:
+        for name, value in row.items():
+            if name == "coords":
+                continue
+            if isinstance(value, dict):
+                columns.update(dict.fromkeys((name, key) for key in value))
+            else:
+                columns[name] = None
+    columns = list(columns)
+    words = max(1, -(-len(columns) // MASK_BITS))
+
+    def cell(row, column):
+        if isinstance(column, tuple):
+            return (row.get(column[0]) or {}).get(column[1])
+        return row.get(column)
+
+    def value_key(value):
+        return json.dumps(value, sort_keys=True, ensure_ascii=False)
+
+    values = []
+    indices = []
+    for column in columns:
+        counts = {}
+        for row in rows:
+            value = cell(row, column)
+            if value is not None:
+                count = counts.setdefault(value_key(value), [value, 0])
+                count[1] += 1
+        total = sum(n for _, n in counts.values())
+        if total and len(counts) <= total * INTERN_RATIO:
+            ranked = sorted(counts.items(), key=lambda kv: -kv[1][1])
+            values.append([value for _, (value, _) in ranked])
+            indices.append({key: i for i, (key, _) in enumerate(ranked)})
+        else:
+            values.append(None)
+            indices.append(None)
+
+    def encode_row(row):
+        encoded = [0] * words
+        for i, column in enumerate(columns):
+            value = cell(row, column)
+            if value is None:
+                continue
+            encoded[i // MASK_BITS] |= 1 << (i % MASK_BITS)
+            if indices[i] is not None:
+                value = indices[i][value_key(value)]
+            encoded.append(value)
+        return encoded
+
+    return {
+        "format": "compact-1",
+        "columns": [list(c) if isinstance(c, tuple) else c for c in columns],
+        "values": values,
+        "groups": {
+            key: {
+                **group,
+                "coords": round_coords(group["coords"]),
+                "rows": [encode_row(row) for row in group["rows"]],
+            }
+            for key, group in grouped.items()
+        },
+    }
+
+
+# Missing values come back as None, missing keys of split objects are
+# left out, and rows get their group's coords.
+def decode_compact(data):
+    if data.get("format") != "compact-1":
+        return data
+
+    columns = data["columns"]
+    values = data["values"]
+    names = [c[0] if isinstance(c, list) else c for c in columns]
+    words = max(1, -(-len(columns) // MASK_BITS))
+
+    def decode_row(encoded, coords):
+        row = dict.fromkeys(names)
+        row["coords"] = coords
+        j = words
+        for i, column in enumerate(columns):
+            if not encoded[i // MASK_BITS] & (1 << (i % MASK_BITS)):
+                continue
+            value = encoded[j]
+            j += 1
+            if values[i] is not None:
+                value = values[i][value]
+            if isinstance(column, list):
+                row[column[0]] = row[column[0]] or {}
+                row[column[0]][column[1]] = value
+            else:
+                row[column] = value
+        return row
+
+    return {
+        key: {
+            **group,
+            "rows": [decode_row(r, group["coords"]) for r in group["rows"]],
+        }
+        for key, group in data["groups"].items()
+    }
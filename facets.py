@@ -0,0 +1,89 @@
+import base64
+
+from export import write_json
+from search import delta_encode
+
+
+# the values of a row's filter, per filter of the map
+FACETS = {
+    "primary_type": lambda f: [f["song_type"]["main"]],
+    "secondary_type": lambda f: f["song_type"]["secondary"],
+    "instrument": lambda f: f["instrument"],
+    "collector": lambda f: [f["collector"]],
+}
+
+
+# Row ids and group ids per facet value. Rows are numbered in the order
+# of the groups and of the rows within them, and groups in the order of
+# hitta/index.json, so the rows of group i are the next index.groups[i][2]
+# ids after those of the groups before it.
+def facet_ids(grouped):
+    rows = {facet: {} for facet in FACETS}
+    groups = {facet: {} for facet in FACETS}
+    row_id = 0
+    for group_id, group in enumerate(grouped.values()):
+        for row in group["rows"]:
+            filt = row.get("filter")
+            for facet, values_of in FACETS.items():
+                for value in dict.fromkeys(values_of(filt) if filt else []):
+                    if not value:
+                        continue
+                    rows[facet].setdefault(value, []).append(row_id)
+                    ids = groups[facet].setdefault(value, [])
+                    if not ids or ids[-1] != group_id:
+                        ids.append(group_id)
+            row_id += 1
+    return rows, groups, row_id
+
+
+# A set of ids below size, as whichever is shorter: a bitset of 32-bit
+# little-endian words in base64 (bit i is id i), or the sorted ids as
+# differences to the previous one, as in the search index.
+def encode_ids(ids, size):
+    words = (size + 31) // 32
+    bitset_length = (words * 4 + 2) // 3 * 4
+    deltas = delta_encode(ids)
+    if sum(len(str(d)) + 1 for d in deltas) < bitset_length:
+        return deltas
+
+    bits = bytearray(words * 4)
+    for i in ids:
+        bits[i >> 3] |= 1 << (i & 7)
+    return base64.b64encode(bits).decode("ascii")
+
+
+# Writes the facet index the map filters with, instead of going through
+# every row:
+#
+#   {"rows": 5123, "groups": 1480,
+#    "facets": {"instrument": {"Fiol": [2210, "//8P...", [0, 3, 1, ...]], ...},
+#               ...}}
+#
+# Each value has its number of rows, its row set and its group set
+# (encoded with encode_ids), and values are sorted by count. Filters on
+# different facets are combined by ANDing row sets; a group matches if
+# any of its rows is in the result.
+def build_facets(grouped):
+    rows, groups, n_rows = facet_ids(grouped)
+    n_groups = len(grouped)
+    return {
+        "rows": n_rows,
+        "groups": n_groups,
+        "facets": {
+            facet: {
+                value: [
+                    len(ids),
+                    encode_ids(ids, n_rows),
+                    encode_ids(groups[facet][value], n_groups),
+                ]
+                for value, ids in sorted(values.items(), key=lambda kv: -len(kv[1]))
+            }
+            for facet, values in rows.items()
+        },
+    }
+
+
+def write_facets(grouped, path):
+    facets = build_facets(grouped)
+    write_json(path, facets)
+    return facets
@@ -0,0 +1,169 @@
+import bisect
+import difflib
+import json
+import os
+import time
+from collections import defaultdict
+
+import numpy as np
+from geopy.location import Location
+from pyproj import Transformer
+
+import text
+
+
+# Local place name index over a downloaded Lantmäteriet gazetteer. The
+# file has one searchservice result per line, e.g.
+#
+#   {"typ": "ORTNAMN", "position": {"east": 401378, "north": 6487224},
+#    "id": "4328929", "headertext": "Källby", "subtext": "Götene | Tätort"}
+#
+# Positions are SWEREF99 TM (EPSG:3006) and are converted to WGS84 once,
+# for the whole file, when it's loaded. The file is downloaded from the
+# searchservice of Lantmäteriet's Min karta with fetch_gazetteer, for
+# every place name in the catalog:
+#
+#   python process.py fetch-gazetteer ortnamn.jsonl
+
+SEARCH_URL = "https://minkarta.lantmateriet.se/api/searchservice/searchinput"
+
+
+def normalize_name(s):
+    return " ".join(s.lower().split())
+
+
+# "Källby" -> "kallby", so that fuzzy lookups also forgive missing or
+# wrong diacritics
+def fold_name(s):
+    return normalize_name(text.fold(s))
+
+
+class Gazetteer:
+    def __init__(self, path, landskap):
+        self.landskap = landskap
+
+        ids = []
+        names = []
+        types = []
+        subtexts = []
+        east = []
+        north = []
+        with open(path) as f:
+            for line in f:
+                entry = json.loads(line)
+                if entry["typ"] == "ADRESS":
+                    continue
+                ids.append(entry["id"])
+                names.append(entry["headertext"])
+                types.append(entry["typ"])
+                subtexts.append(entry.get("subtext", ""))
+                east.append(entry["position"]["east"])
+                north.append(entry["position"]["north"])
+
+        self.ids = ids
+        self.names = names
+        self.types = types
+        self.subtexts = subtexts
+
+        transformer = Transformer.from_crs("EPSG:3006", "EPSG:4326", always_xy=True)
+        self.lng, self.lat = transformer.transform(
+            np.asarray(east, dtype=float), np.asarray(north, dtype=float)
+        )
+
+        by_name = defaultdict(list)
+        for i, name in enumerate(names):
+            by_name[normalize_name(name)].append(i)
+        self.by_name = {k: np.asarray(v) for k, v in by_name.items()}
+        self.sorted_names = sorted(self.by_name)
+
+        by_folded = defaultdict(list)
+        for name in self.by_name:
+            by_folded[fold_name(name)].append(name)
+        self.by_folded = dict(by_folded)
+        self.sorted_folded = sorted(self.by_folded)
+
+    def __len__(self):
+        return len(self.names)
+
+    def complete(self, prefix, limit=None):
+        prefix = normalize_name(prefix)
+        start = bisect.bisect_left(self.sorted_names, prefix)
+        end = bisect.bisect_left(self.sorted_names, prefix + "\uffff")
+        names = self.sorted_names[start:end]
+        return names[:limit] if limit else names
+
+    def lookup(self, name, fuzzy=True):
+        name = normalize_name(name)
+        if name in self.by_name:
+            return self.by_name[name]
+        if not fuzzy or len(name) < 4:
+            return np.empty(0, dtype=int)
+
+        # only compare against names sharing the first two letters
+        # (without diacritics), which keeps fuzzy matching cheap on a
+        # large gazetteer
+        folded = fold_name(name)
+        start = bisect.bisect_left(self.sorted_folded, folded[:2])
+        end = bisect.bisect_left(self.sorted_folded, folded[:2] + "\uffff")
+        matches = difflib.get_close_matches(
+            folded, self.sorted_folded[start:end], n=1, cutoff=0.9
+        )
+        if not matches:
+            return np.empty(0, dtype=int)
+        return np.concatenate([self.by_name[n] for n in self.by_folded[matches[0]]])
+
+    def within(self, idx, landskap):
+        if len(idx) == 0:
+            return idx
+        located = self.landskap.classify(self.lat[idx], self.lng[idx])
+        return idx[np.isin(located, landskap)]
+
+    def search(self, name, landskap, fuzzy=True) -> list[Location]:
+        idx = self.within(self.lookup(name, fuzzy=fuzzy), landskap)
+        return [self.location(i) for i in idx]
+
+    def location(self, i) -> Location:
+        return Location(
+            f"{self.names[i]}, {self.subtexts[i]}".strip(" ,"),
+            (float(self.lat[i]), float(self.lng[i])),
+            {"types": [self.types[i]], "id": self.ids[i]},
+        )
+
+
+# Downloads the searchservice results for each of names to path, one
+# result per line in the format Gazetteer reads, without addresses and
+# without duplicates. The names that have been searched are listed in
+# path + ".queries", so that an interrupted download goes on where it
+# stopped.
+def fetch_gazetteer(names, path, rate=2.0, timeout=30):
+    import requests
+
+    queries_path = path + ".queries"
+    done = set()
+    if os.path.exists(queries_path):
+        with open(queries_path) as f:
+            done = {line.rstrip("\n") for line in f}
+    ids = set()
+    if os.path.exists(path):
+        with open(path) as f:
+            ids = {json.loads(line)["id"] for line in f}
+
+    todo = sorted(set(names) - done)
+    session = requests.Session()
+    with open(path, "a") as out, open(queries_path, "a") as queries:
+        for i, name in enumerate(todo):
+            response = session.get(
+                SEARCH_URL, params={"searchtext": name}, timeout=timeout
+            )
+            response.raise_for_status()
+            for entry in response.json().get("sokresultat", []):
+                if entry["typ"] == "ADRESS" or entry["id"] in ids:
+                    continue
+                ids.add(entry["id"])
+                out.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            out.flush()
+            queries.write(name + "\n")
+            queries.flush()
+            print(f"{i + 1}/{len(todo)} {name}")
+            time.sleep(1 / rate)
+    return len(ids)
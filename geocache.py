@@ -0,0 +1,178 @@
+from __future__ import annotations
+
+import json
+import os
+import pickle
+import sqlite3
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+# importing geopy imports all of its geocoders, so it's only done when a
+# Location is made
+if TYPE_CHECKING:
+    from geopy.location import Location
+
+
+# Geocode results are stored as compact records, one row per query:
+#
+#   query   | "Källby, Västergötland"
+#   results | [[lat, lng, address, [types...]], ...]  (empty list = no hits)
+#   created | unix timestamp
+#
+# The database runs in WAL mode so every put is its own small, crash
+# safe transaction instead of a rewrite of the whole cache.
+#
+# A read-only cache (e.g. in the worker processes of a parallel build)
+# keeps what's put into it in memory, in `new`, for its owner to pass on
+# to a writable cache with put_many.
+
+
+class GeocodeCache:
+    def __init__(self, path="geocode.db", ttl=None, read_only=False):
+        self.path = path
+        self.ttl = ttl
+        self.read_only = read_only
+        self.new = {}
+        if read_only:
+            uri = Path(path).absolute().as_uri() + "?mode=ro"
+            self.conn = sqlite3.connect(uri, uri=True)
+            return
+
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS geocode (
+                query TEXT PRIMARY KEY,
+                results TEXT NOT NULL,
+                created REAL NOT NULL
+            )
+            """
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)"
+        )
+        self.conn.commit()
+
+    def get(self, query) -> list[Location] | None:
+        if query in self.new:
+            return self.new[query]
+
+        row = self.conn.execute(
+            "SELECT results, created FROM geocode WHERE query = ?", (query,)
+        ).fetchone()
+        if row is None:
+            return None
+
+        results, created = row
+        if self.is_expired(created):
+            return None
+
+        return [record_to_location(r) for r in json.loads(results)]
+
+    def __contains__(self, query):
+        return self.get(query) is not None
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM geocode").fetchone()[0]
+
+    def stats(self):
+        entries, empty, oldest, newest = self.conn.execute(
+            "SELECT COUNT(*), SUM(results = '[]'), MIN(created), MAX(created) FROM geocode"
+        ).fetchone()
+        return {
+            "entries": entries,
+            "empty": empty or 0,
+            "oldest": oldest,
+            "newest": newest,
+        }
+
+    def is_expired(self, created):
+        return self.ttl is not None and created < time.time() - self.ttl
+
+    def put(self, query, locs, created=None):
+        if self.read_only:
+            self.new[query] = list(locs or [])
+            return
+        with self.conn:
+            self._put(query, locs, created)
+
+    def put_many(self, entries, created=None):
+        with self.conn:
+            for query, locs in entries.items():
+                self._put(query, locs, created)
+
+    def _put(self, query, locs, created=None):
+        records = [location_to_record(loc) for loc in locs or []]
+        self.conn.execute(
+            "INSERT OR REPLACE INTO geocode (query, results, created) VALUES (?, ?, ?)",
+            (
+                query,
+                json.dumps(records, ensure_ascii=False),
+                time.time() if created is None else created,
+            ),
+        )
+
+    # (query, results) of every entry, expired or not, in query order
+    def entries(self):
+        rows = self.conn.execute("SELECT query, results FROM geocode ORDER BY query")
+        for query, results in rows:
+            yield query, json.loads(results)
+
+    def invalidate(self, query=None, older_than=None):
+        with self.conn:
+            if query is not None:
+                cur = self.conn.execute("DELETE FROM geocode WHERE query = ?", (query,))
+            elif older_than is not None:
+                cur = self.conn.execute(
+                    "DELETE FROM geocode WHERE created < ?", (time.time() - older_than,)
+                )
+            else:
+                cur = self.conn.execute("DELETE FROM geocode")
+        return cur.rowcount
+
+    def migrate_pickle(self, path="loc.cache"):
+        migrated = self.conn.execute(
+            "SELECT value FROM meta WHERE key = 'migrated_pickle'"
+        ).fetchone()
+        if migrated or not os.path.exists(path):
+            return 0
+
+        from geopy.location import Location
+
+        with open(path, "rb") as f:
+            old_cache = pickle.load(f)
+
+        created = os.path.getmtime(path)
+        with self.conn:
+            for query, locs in old_cache.items():
+                if isinstance(locs, Location):
+                    locs = [locs]
+                if self.conn.execute(
+                    "SELECT 1 FROM geocode WHERE query = ?", (query,)
+                ).fetchone():
+                    continue
+                self._put(query, locs, created)
+            self.conn.execute(
+                "INSERT INTO meta (key, value) VALUES ('migrated_pickle', ?)",
+                (os.path.abspath(path),),
+            )
+
+        return len(old_cache)
+
+    def close(self):
+        self.conn.close()
+
+
+def location_to_record(loc: Location):
+    raw = loc.raw or {}
+    return [loc.latitude, loc.longitude, loc.address, raw.get("types", [])]
+
+
+def record_to_location(record) -> Location:
+    from geopy.location import Location
+
+    lat, lng, address, types = record
+    return Location(address, (lat, lng), {"types": types})
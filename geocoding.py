@@ -0,0 +1,146 @@
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from geopy.exc import (
+    GeocoderQueryError,
+    GeocoderQuotaExceeded,
+    GeocoderRateLimited,
+    GeocoderTimedOut,
+    GeocoderUnavailable,
+)
+
+from geocache import location_to_record, record_to_location
+
+
+RETRY_ERRORS = (
+    GeocoderQuotaExceeded,
+    GeocoderRateLimited,
+    GeocoderTimedOut,
+    GeocoderUnavailable,
+)
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def geocode_with_retry(geocoder, query, bucket, bounds=None, retries=5, backoff=1.0):
+    for attempt in range(retries + 1):
+        if bucket:
+            bucket.acquire()
+        try:
+            return geocoder.geocode(query, exactly_one=False, bounds=bounds) or []
+        except GeocoderQueryError:
+            print("query error", query)
+            return []
+        except RETRY_ERRORS as e:
+            if attempt == retries:
+                raise
+            delay = getattr(e, "retry_after", None) or backoff * 2**attempt
+            time.sleep(delay * random.uniform(1, 1.5))
+
+
+# Resolve queries concurrently, yielding (query, locations) as they
+# complete. Queries that still fail after all retries are skipped, so
+# they stay uncached and are retried on the next run. A rate of None
+# doesn't limit the rate, e.g. for a geocoder that replays a recording.
+def geocode_batch(geocoder, queries, bounds=None, workers=8, rate=40, retries=5):
+    bucket = TokenBucket(rate) if rate else None
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(geocode_with_retry, geocoder, q, bucket, bounds, retries): q
+            for q in queries
+        }
+        for future in as_completed(futures):
+            query = futures[future]
+            try:
+                yield query, future.result()
+            except RETRY_ERRORS as e:
+                print("geocode failed", query, e)
+
+
+# Geocoders for offline and repeatable runs. They take and return what
+# geopy's geocoders do, so any of them can be used where GoogleV3 is.
+# Recordings are JSONL, one response per line, in the cache's record
+# format:
+#
+#   {"query": "Källby, Västergötland", "results": [[58.5, 13.3, "...", [...]]]}
+
+
+class ReplayMiss(Exception):
+    pass
+
+
+# Passes every query on to geocoder and appends the response to path.
+# Failed requests aren't recorded.
+class RecordingGeocoder:
+    def __init__(self, geocoder, path):
+        self.geocoder = geocoder
+        self.path = path
+        self.lock = threading.Lock()
+
+    def geocode(self, query, exactly_one=False, bounds=None):
+        locs = self.geocoder.geocode(query, exactly_one=exactly_one, bounds=bounds)
+        locs = locs or []
+        line = json.dumps(
+            {"query": query, "results": [location_to_record(loc) for loc in locs]},
+            ensure_ascii=False,
+        )
+        with self.lock, open(self.path, "a") as f:
+            f.write(line + "\n")
+        return locs
+
+
+# Answers from a recording, which is read into a dict up front. A query
+# that wasn't recorded raises ReplayMiss, or goes to the fallback
+# geocoder if there is one. If a query was recorded more than once the
+# last response wins.
+class ReplayGeocoder:
+    def __init__(self, path, fallback=None):
+        self.fallback = fallback
+        self.responses = {}
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    self.responses[entry["query"]] = entry["results"]
+
+    def __len__(self):
+        return len(self.responses)
+
+    def geocode(self, query, exactly_one=False, bounds=None):
+        records = self.responses.get(query)
+        if records is not None:
+            return [record_to_location(r) for r in records]
+        if self.fallback is None:
+            raise ReplayMiss(f"not in the recording: {query}")
+        return self.fallback.geocode(query, exactly_one=exactly_one, bounds=bounds)
+
+
+# A fallback for replays that treats unrecorded queries as having no
+# results
+class NoResultsGeocoder:
+    def geocode(self, query, exactly_one=False, bounds=None):
+        return []
@@ -0,0 +1,98 @@
+import contextlib
+import datetime
+import json
+import time
+from collections import Counter
+
+
+# What a build spent its time and geocode quota on, written as JSON next
+# to the output:
+#
+#   {"started": "2026-10-18T12:00:00", "seconds": 41.2,
+#    "stages": {"load_catalog": 0.4, "locations": 30.1, ...},
+#    "counts": {"rows": 5123, "cache_hits": 9800, "cache_misses": 12,
+#               "fallbacks": 40, "out_of_bounds": 52, "api_calls": 12},
+#    "api_calls": {"Källby, Västergötland": 1, ...}}
+#
+# Stages add up if they're entered more than once.
+class RunReport:
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.started = datetime.datetime.now()
+        self.t0 = time.perf_counter()
+        self.stages = {}
+        self.counts = Counter()
+        self.api_calls = Counter()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - t
+
+    def count(self, name, n=1):
+        self.counts[name] += n
+
+    def api_call(self, query):
+        self.api_calls[query] += 1
+        self.counts["api_calls"] += 1
+
+    def to_dict(self):
+        return {
+            "started": self.started.isoformat(timespec="seconds"),
+            "seconds": round(time.perf_counter() - self.t0, 3),
+            "stages": {name: round(s, 3) for name, s in self.stages.items()},
+            "counts": dict(self.counts),
+            "api_calls": dict(self.api_calls.most_common()),
+        }
+
+    def write(self, path):
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, indent=1)
+
+    def summary(self):
+        report = self.to_dict()
+        lines = [f"{'total':16} {report['seconds']:8.2f} s"]
+        lines += [f"{name:16} {s:8.2f} s" for name, s in report["stages"].items()]
+        lines += [f"{name:16} {n:8}" for name, n in sorted(report["counts"].items())]
+        return "\n".join(lines)
+
+
+# Wraps a geopy geocoder so that every request made through it,
+# including retries, is counted in the report.
+class CountingGeocoder:
+    def __init__(self, geocoder, report):
+        self.geocoder = geocoder
+        self.report = report
+
+    def geocode(self, query, *args, **kwargs):
+        self.report.api_call(query)
+        return self.geocoder.geocode(query, *args, **kwargs)
+
+
+# Runs fn under cProfile or pyinstrument, writing the profile to path.
+# pyinstrument is only needed when it's asked for.
+def profiled(fn, profiler, path):
+    if profiler == "pyinstrument":
+        from pyinstrument import Profiler
+
+        profiler = Profiler()
+        profiler.start()
+        try:
+            return fn()
+        finally:
+            profiler.stop()
+            with open(path, "w") as f:
+                f.write(profiler.output_html())
+
+    import cProfile
+
+    profile = cProfile.Profile()
+    try:
+        return profile.runcall(fn)
+    finally:
+        profile.dump_stats(path)
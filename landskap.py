@@ -0,0 +1,52 @@
+import json
+
+import numpy as np
+import shapely
+from shapely.geometry import shape
+
+
+class LandskapIndex:
+    def __init__(self, path="svenska-landskap.geo.json"):
+        with open(path) as f:
+            features = json.load(f)["features"]
+
+        self.names = np.array(
+            [feat["properties"]["landskap"] for feat in features], dtype=object
+        )
+        self.geoms = np.array([shape(feat["geometry"]) for feat in features])
+        shapely.prepare(self.geoms)
+        self.tree = shapely.STRtree(self.geoms)
+        self.shapes = dict(zip(self.names, self.geoms))
+
+    def __contains__(self, ls):
+        return ls in self.shapes
+
+    # Returns the landskap name (or None) for each point. The tree
+    # narrows each point down to the few polygons whose envelope it's
+    # in before the exact containment test. Points outside every
+    # polygon but within `tolerance` degrees of one (islands and skerries
+    # the simplified coastline misses) get the nearest landskap.
+    def classify(self, lats, lngs, tolerance=0.03) -> np.ndarray:
+        points = shapely.points(
+            np.asarray(lngs, dtype=float), np.asarray(lats, dtype=float)
+        )
+        point_idx, geom_idx = self.tree.query(points, predicate="within")
+        result = np.full(len(points), None, dtype=object)
+        result[point_idx] = self.names[geom_idx]
+
+        if tolerance:
+            found = np.zeros(len(points), dtype=bool)
+            found[point_idx] = True
+            outside = np.flatnonzero(~found)
+            if len(outside):
+                near_idx, geom_idx = self.tree.query_nearest(
+                    points[outside], max_distance=tolerance
+                )
+                result[outside[near_idx]] = self.names[geom_idx]
+
+        return result
+
+    def classify_locations(self, locs) -> np.ndarray:
+        return self.classify(
+            [loc.latitude for loc in locs], [loc.longitude for loc in locs]
+        )
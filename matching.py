@@ -0,0 +1,208 @@
+import json
+import os
+import re
+import sqlite3
+from collections import Counter, defaultdict
+
+import text
+
+
+# The spider's record store, or its JSONL feed if there's no store
+VISARKIV_PATHS = ["visarkiv/records.db", "visarkiv/output.jsonl"]
+
+# blocks with more records than this (common surnames, big places in a
+# busy year) say little about a match and would make the number of
+# compared pairs quadratic, so they're skipped
+MAX_BLOCK = 200
+
+WEIGHTS = {"people": 0.45, "place": 0.25, "year": 0.15, "title": 0.15}
+MIN_SCORE = 0.6
+
+
+def fold(s):
+    return re.sub(r"[^a-z0-9]+", " ", text.fold(s)).strip()
+
+
+# dropped from places, which are often "Parish, Landskap" or "Place sn"
+LANDSKAP = {
+    fold(name)
+    for name in """
+    Blekinge Bohuslän Dalarna Dalsland Gotland Gästrikland Halland Hälsingland
+    Härjedalen Jämtland Lappland Medelpad Norrbotten Närke Skåne Småland
+    Södermanland Uppland Värmland Västerbotten Västergötland Västmanland
+    Ångermanland Öland Östergötland
+    """.split()
+}
+LANDSKAP_ABBREVIATIONS = {"vg", "bo", "dsl", "sn", "lan", "socken"}
+
+
+# "Andersson, Emil (fiol, röst); Eriksson, Nils" -> {"andersson e",
+# "eriksson n"}, and the same for "Emil Andersson"
+def people(names):
+    keys = set()
+    for name in re.split(r";| och | & ", names or ""):
+        name = re.sub(r"\([^)]*\)", "", name)
+        if "," in name:
+            last, first = name.split(",", 1)
+        else:
+            parts = name.split()
+            last, first = (parts[-1], " ".join(parts[:-1])) if parts else ("", "")
+        last, first = fold(last), fold(first)
+        if last:
+            keys.add(f"{last} {first[:1]}".strip())
+    return keys
+
+
+# "Storsätern, Idre; St. Levene, Västergötland" -> {"storsatern",
+# "idre", "st levene"}
+def places(*values):
+    result = set()
+    for value in values:
+        for part in re.split(r"[;,]", value or ""):
+            place = fold(part)
+            words = [w for w in place.split() if w not in LANDSKAP_ABBREVIATIONS]
+            place = " ".join(words)
+            if len(place) > 2 and place not in LANDSKAP:
+                result.add(place)
+    return result
+
+
+def year(*values):
+    for value in values:
+        match = re.search(r"\b(1[89]\d\d|20\d\d)\b", str(value or ""))
+        if match:
+            return int(match.group(1))
+    return None
+
+
+def visarkiv_features(record):
+    return {
+        "people": people(record.get("namn")),
+        "places": places(record.get("ort"), record.get("spelplats")),
+        "year": year(record.get("datum")),
+        "text": fold(record.get("innehall")),
+    }
+
+
+def hitta_features(row):
+    return {
+        "people": people(row.get("Sångare,  Instrumentalist, namn")),
+        "places": places(row.get("Proveniens")),
+        "year": year(
+            row.get("Inspelat år"),
+            row.get("Inspelat år.1"),
+            row.get("Inspelat/nedtecknat år"),
+        ),
+        "title": fold(row.get("Titel eller låtnamn")),
+    }
+
+
+def blocking_keys(features):
+    keys = [("person", p) for p in features["people"]]
+    if features["year"]:
+        keys += [("place", p, features["year"]) for p in features["places"]]
+    return keys
+
+
+def shares_place(h, v):
+    return bool(h["places"] & v["places"])
+
+
+def title_in(h, v):
+    return len(h["title"]) > 3 and h["title"] in v["text"]
+
+
+def score(h, v):
+    total = 0.0
+    if h["people"] and v["people"]:
+        shared = len(h["people"] & v["people"])
+        total += WEIGHTS["people"] * shared / len(h["people"] | v["people"])
+    if shares_place(h, v):
+        total += WEIGHTS["place"]
+    if h["year"] and v["year"]:
+        diff = abs(h["year"] - v["year"])
+        total += WEIGHTS["year"] * (1 if diff == 0 else 0.5 if diff == 1 else 0)
+    if title_in(h, v):
+        total += WEIGHTS["title"]
+    return total
+
+
+# Finds the best visarkiv record for every hitta row. Records are put in
+# an inverted index on their blocking keys (performer, and place in a
+# year), and each row is only scored against the records it shares a
+# key with, so the work grows with the size of the blocks rather than
+# with the product of the two sources. A match needs the place or the
+# title to agree too, since a performer and a year alone fit every
+# recording of that performer in that year, and a row that several
+# records match equally well is left unmatched. Returns a (record
+# index, score) pair, or None, per row.
+def match(hitta_rows, records, min_score=MIN_SCORE):
+    record_features = [visarkiv_features(r) for r in records]
+    index = defaultdict(list)
+    for i, features in enumerate(record_features):
+        for key in blocking_keys(features):
+            index[key].append(i)
+
+    matches = []
+    for row in hitta_rows:
+        h = hitta_features(row)
+        candidates = set()
+        for key in blocking_keys(h):
+            block = index.get(key, ())
+            if len(block) <= MAX_BLOCK:
+                candidates.update(block)
+
+        best = None
+        tied = False
+        for i in sorted(candidates):
+            v = record_features[i]
+            if not (shares_place(h, v) or title_in(h, v)):
+                continue
+            s = score(h, v)
+            if s < min_score or (best is not None and s < best[1]):
+                continue
+            tied = best is not None and s == best[1]
+            best = (i, s)
+        matches.append(None if tied else best)
+    return matches
+
+
+def load_visarkiv_records(path=None):
+    if path is None:
+        path = next((p for p in VISARKIV_PATHS if os.path.exists(p)), None)
+        if path is None:
+            return []
+
+    if path.endswith(".jsonl"):
+        with open(path) as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    try:
+        return [dict(row) for row in conn.execute("SELECT * FROM records")]
+    finally:
+        conn.close()
+
+
+# Sets "media_url" on the hitta rows that match a visarkiv record with
+# audio, and returns how many did.
+def add_media_urls(hitta_rows, records):
+    matched = 0
+    for row, m in zip(hitta_rows, match(hitta_rows, records)):
+        if m is not None and records[m[0]].get("media_url"):
+            row["media_url"] = records[m[0]]["media_url"]
+            matched += 1
+    return matched
+
+
+def match_stats(hitta_rows, records):
+    matches = match(hitta_rows, records)
+    scores = Counter(round(m[1], 1) for m in matches if m)
+    return {
+        "rows": len(hitta_rows),
+        "records": len(records),
+        "matched": sum(m is not None for m in matches),
+        "records_matched": len({m[0] for m in matches if m}),
+        "scores": dict(sorted(scores.items())),
+    }
@@ -1,28 +1,98 @@
 # TODO:
 # Group items by socken
 
+from __future__ import annotations
 
-import random
+import argparse
+import functools
+import hashlib
 import math
 import datetime
 import json
-import pandas as pd
-import geopandas as gpd
-import pickle
 import os
-import geopy
-from geopy.point import Point
-from geopy.location import Location
-from geopy.distance import geodesic
-from geopy.exc import GeocoderQueryError
+import subprocess
+import sys
+import time
+from collections import Counter
+from typing import TYPE_CHECKING
+
+from geocache import GeocodeCache
+from clusters import write_clusters
+from facets import write_facets
+from export import (
+    decode_compact,
+    encode_compact,
+    round_coords,
+    write_json,
+    write_sharded,
+)
+from instrumentation import CountingGeocoder, RunReport, profiled
+from spatial import displace_groups
+
+# geopy imports all of its geocoders and aiohttp, so it's only imported
+# where it's used
+if TYPE_CHECKING:
+    from geopy.location import Location
+
+
+# set of query strings while prefetch_locations does its dry run
+PENDING = None
+
+# timings and geocode counts of the current build
+REPORT = RunReport()
+
+# set in the worker processes of a parallel build, which only read the
+# geocode cache and send their new entries back to the parent
+READ_ONLY_CACHE = False
+
+REGION_LANDSKAP = ["Västergötland", "Bohuslän", "Dalsland"]
+
+SPELLING_FIXES = {
+    "bovallsstrand": "bovallstrand",
+}
+
+# "google" or "lantmateriet"
+GEOCODER = os.environ.get("GEOCODER", "google")
+
+# Where "google" gets its results: "google" asks the API, "record" asks
+# the API and appends every response to GEOCODE_RECORDING, and "replay"
+# only answers from GEOCODE_RECORDING, without an API key or network.
+GEOCODER_BACKEND = os.environ.get("GEOCODER_BACKEND", "google")
+GEOCODE_RECORDING = os.environ.get("GEOCODE_RECORDING", "geocode-recording.jsonl")
+# what a replay does with a query that isn't in the recording: "fail",
+# "empty" (no results) or "google"
+REPLAY_MISS = os.environ.get("REPLAY_MISS", "fail")
+
+GEOCODE_CACHE_PATH = "geocode.db"
+# cached results older than this many days are geocoded again; unset,
+# they're kept until invalidated with the invalidate-cache command
+GEOCODE_CACHE_TTL = os.environ.get("GEOCODE_CACHE_TTL")
+GEOCODE_CACHE_TTL = float(GEOCODE_CACHE_TTL) if GEOCODE_CACHE_TTL else None
+DAY = 24 * 60 * 60
 
+CATALOG_PATH = "hitta-folkmusiken.xls"
+CATALOG_SNAPSHOT_PATH = "hitta-folkmusiken.feather"
 
-CACHE = {}
+HITTA_PATH = "vastgotalatar/public/hitta.json"
+SHARDS_DIR = "vastgotalatar/public/hitta"
+CLUSTERS_DIR = "vastgotalatar/public/hitta/clusters"
+FACETS_PATH = "vastgotalatar/public/hitta/facets.json"
+SEARCH_PATH = "vastgotalatar/public/search.json"
+MANIFEST_PATH = "hitta.manifest.json"
+MANIFEST_VERSION = 1
+REPORT_PATH = "build-report.json"
+PROFILE_PATHS = {"cprofile": "build.prof", "pyinstrument": "build-profile.html"}
 
-gmaps = geopy.GoogleV3(os.environ["GMAPS_API_KEY"])
+LANDSKAP_PATH = "svenska-landskap.geo.json"
+LANDSKAP_BOUNDS_PATH = "landskap-bounds.json"
+
+# seconds; checked by `python process.py import-time`
+IMPORT_TIME_BUDGET = 0.25
 
 
 def cell_to_str(fmt):
+    import pandas as pd
+
     def wrapped(x):
         if pd.notnull(x) and isinstance(x, (pd.Timestamp, datetime.datetime)):
             return x.strftime(fmt)
@@ -45,8 +115,37 @@ def get_filter(row):
     }
 
 
+# Same output as get_filter on every row, but each distinct value of a
+# filter column is only normalized once and the results are broadcast
+# back to the rows.
+def get_filters(df):
+    song_types = map_distinct(df["Låttyp eller visgenre"], song_type_filter)
+    instruments = map_distinct(df["Sång  instrument"], instrument_filter)
+    collectors = map_distinct(df["Inspelat/ inlämnat av"], collector_filter)
+    return [
+        {"song_type": s, "instrument": i, "collector": c}
+        for s, i, c in zip(song_types, instruments, collectors)
+    ]
+
+
+def map_distinct(column, fn):
+    import numpy as np
+    import pandas as pd
+
+    codes, uniques = pd.factorize(column)
+    values = np.empty(len(uniques) + 1, dtype=object)
+    for i, v in enumerate(uniques):
+        values[i] = fn(v)
+    # missing values get code -1, i.e. the last slot
+    values[-1] = fn(None)
+    return values[codes]
+
+
 def get_collector_filter(row):
-    collector = row["Inspelat/ inlämnat av"]
+    return collector_filter(row["Inspelat/ inlämnat av"])
+
+
+def collector_filter(collector):
     if not collector:
         return ""
 
@@ -64,7 +163,10 @@ def get_collector_filter(row):
 
 
 def get_song_type_filter(row):
-    song_type = row["Låttyp eller visgenre"]
+    return song_type_filter(row["Låttyp eller visgenre"])
+
+
+def song_type_filter(song_type):
     if not song_type or not song_type.strip():
         return {
             "main": "",
@@ -79,6 +181,7 @@ def get_song_type_filter(row):
     }
 
 
+@functools.cache
 def normalize_instrument(s):
     if s == "m.m" or s == "-":
         return ""
@@ -114,7 +217,10 @@ def normalize_string(s):
 
 
 def get_instrument_filter(row):
-    instrument = row["Sång  instrument"]
+    return instrument_filter(row["Sång  instrument"])
+
+
+def instrument_filter(instrument):
     if not instrument or not instrument.strip():
         return []
 
@@ -127,8 +233,19 @@ def get_instrument_filter(row):
     return parts
 
 
-def create_hitta_data():
-    df = pd.read_excel("hitta-folkmusiken.xls", parse_dates=False)
+def load_hitta_df(use_snapshot=True):
+    if not use_snapshot:
+        return read_hitta_excel()
+
+    from snapshot import load_snapshot
+
+    return load_snapshot(CATALOG_PATH, CATALOG_SNAPSHOT_PATH, read_hitta_excel)
+
+
+def read_hitta_excel():
+    import pandas as pd
+
+    df = pd.read_excel(CATALOG_PATH, parse_dates=False)
     for year_column in [
         "Inspelat år",
         "Inspelat år.1",
@@ -137,6 +254,12 @@ def create_hitta_data():
         "Tid på inspelningen",
     ]:
         df[year_column] = df[year_column].apply(cell_to_str("%Y"))
+    return df
+
+
+def load_hitta_rows(df=None):
+    if df is None:
+        df = load_hitta_df()
     hitta = df.to_dict("records")
 
     for row in hitta:
@@ -144,31 +267,286 @@ def create_hitta_data():
             if isinstance(v, float) and math.isnan(v):
                 row[k] = None
 
-        locations = get_locations(row["Proveniens"], row["Landskap"])
-        coords = [location_to_coord(loc) for loc in locations]
-        row["coords"] = coords
+    return hitta
+
+
+def create_hitta_data(
+    batch=True,
+    workers=8,
+    rate=40,
+    incremental=False,
+    shard_by="tile",
+    use_snapshot=True,
+    media=True,
+    report_path=REPORT_PATH,
+    compact=False,
+    processes=1,
+):
+    from matching import load_visarkiv_records
+
+    REPORT.reset()
+
+    with REPORT.stage("load_catalog"):
+        df = load_hitta_df(use_snapshot)
+    with REPORT.stage("normalize"):
+        hitta = load_hitta_rows(df)
+    with REPORT.stage("media"):
+        records = load_visarkiv_records()
+        if media:
+            # before hashing, so that rows with a new match are rebuilt
+            add_visarkiv_media(hitta, records)
+    with REPORT.stage("normalize"):
+        hashes = [row_hash(row) for row in hitta]
+
+    # In incremental mode only rows whose content hash isn't in the
+    # manifest from the previous build are processed; everything else is
+    # copied from the manifest.
+    manifest = load_manifest(compact) if incremental else None
+    derived = manifest["rows"] if manifest else {}
+    todo = [i for i, h in enumerate(hashes) if h not in derived]
+    todo_rows = [hitta[i] for i in todo]
+    REPORT.count("rows", len(hitta))
+    REPORT.count("rows_processed", len(todo_rows))
+
+    # The worker processes don't share their cache misses, so a parallel
+    # build always prefetches them first, one at a time if serial, or
+    # places in several chunks would each be geocoded again
+    if (batch or processes > 1) and todo_rows:
+        with REPORT.stage("prefetch"):
+            prefetch_locations(todo_rows, workers=workers if batch else 1, rate=rate)
+
+    with REPORT.stage("filters"):
+        filters = get_filters(df.iloc[todo]) if todo else []
+    with REPORT.stage("locations"):
+        if processes > 1:
+            for row, coords in zip(todo_rows, parallel_coords(todo_rows, processes)):
+                row["coords"] = coords
+        else:
+            for row in todo_rows:
+                locations = get_locations(row["Proveniens"], row["Landskap"])
+                coords = [location_to_coord(loc) for loc in locations]
+                row["coords"] = coords
+        for row, filt in zip(todo_rows, filters):
+            row["filter"] = filt
+
+    for row, h in zip(hitta, hashes):
+        if h in derived:
+            row["coords"] = derived[h]["coords"]
+            row["filter"] = derived[h]["filter"]
+
+    with REPORT.stage("grouping"):
+        if manifest:
+            with open(HITTA_PATH) as f:
+                previous = decode_compact(json.load(f))
+            print(f"{len(todo)} new or changed rows")
+            grouped, members = group_rows(
+                hitta, hashes, previous, manifest["groups"]
+            )
+        else:
+            grouped, members = group_rows(hitta, hashes)
+    REPORT.count("groups", len(grouped))
+
+    with REPORT.stage("write"):
+        # hitta.json is what incremental builds start from; the map only
+        # fetches the shards
+        write_json(
+            HITTA_PATH, encode_compact(grouped) if compact else grouped, compress=False
+        )
+        write_sharded(grouped, SHARDS_DIR, shard_by=shard_by, compact=compact)
+    with REPORT.stage("facets"):
+        write_facets(grouped, FACETS_PATH)
+    with REPORT.stage("clusters"):
+        write_clusters(grouped, CLUSTERS_DIR)
+    with REPORT.stage("search"):
+        write_search(grouped, records)
+
+    save_manifest(hitta, hashes, members, compact)
+
+    REPORT.write(report_path)
+    print(REPORT.summary())
+
+
+# The coords of each row, with the distinct places resolved in chunks
+# over a pool of worker processes. Workers read the geocode cache but
+# don't write to it: whatever they geocode (cache misses that
+# prefetching didn't resolve) is sent back and put in the cache here,
+# together with their counts for the report. The coords are the same,
+# and in the same order, as a serial build's.
+def parallel_coords(rows, processes):
+    from concurrent.futures import ProcessPoolExecutor
+
+    places = list(dict.fromkeys((row["Proveniens"], row["Landskap"]) for row in rows))
+    size = max(1, math.ceil(len(places) / (processes * 4)))
+    chunks = [places[i : i + size] for i in range(0, len(places), size)]
+
+    # make sure the cache exists, so that the workers can open it
+    cache = get_cache()
+    coords = {}
+    with ProcessPoolExecutor(
+        processes, initializer=init_worker, initargs=(worker_settings(),)
+    ) as pool:
+        for chunk, (chunk_coords, entries, counts, api_calls) in zip(
+            chunks, pool.map(resolve_places, chunks)
+        ):
+            coords.update(zip(chunk, chunk_coords))
+            if entries:
+                cache.put_many(entries)
+            REPORT.counts.update(counts)
+            REPORT.api_calls.update(api_calls)
+
+    return [coords[(row["Proveniens"], row["Landskap"])] for row in rows]
+
+
+def worker_settings():
+    return {
+        "GEOCODER": GEOCODER,
+        "GEOCODER_BACKEND": GEOCODER_BACKEND,
+        "GEOCODE_RECORDING": GEOCODE_RECORDING,
+        "REPLAY_MISS": REPLAY_MISS,
+        "GEOCODE_CACHE_PATH": GEOCODE_CACHE_PATH,
+        "GEOCODE_CACHE_TTL": GEOCODE_CACHE_TTL,
+    }
+
 
-        row["filter"] = get_filter(row)
+def init_worker(settings):
+    global READ_ONLY_CACHE
 
-    grouped = {}
-    for row in hitta:
-        prov = row["Proveniens"]
-        if not prov:
+    globals().update(settings)
+    READ_ONLY_CACHE = True
+    # a forked worker has the parent's cache connection and geocoder
+    get_cache.cache_clear()
+    get_geocoder.cache_clear()
+
+
+def resolve_places(places):
+    REPORT.reset()
+    coords = [
+        [location_to_coord(loc) for loc in get_locations(prov, ls)]
+        for prov, ls in places
+    ]
+    cache = get_cache()
+    entries, cache.new = cache.new, {}
+    return coords, entries, dict(REPORT.counts), dict(REPORT.api_calls)
+
+
+def add_visarkiv_media(hitta, records):
+    from matching import add_media_urls
+
+    if records:
+        matched = add_media_urls(hitta, records)
+        print(f"{matched} rows matched to visarkiv audio")
+
+
+def print_match_stats(use_snapshot=True):
+    from matching import load_visarkiv_records, match_stats
+
+    hitta = load_hitta_rows(load_hitta_df(use_snapshot))
+    print(json.dumps(match_stats(hitta, load_visarkiv_records()), indent=2))
+
+
+def write_search(grouped, records):
+    from search import write_search_index
+
+    index = write_search_index(SEARCH_PATH, grouped, records)
+    print(f"{len(index['docs'])} titles and tracks in the search index")
+
+
+# Prints the matching titles and tracks, each with the groups it's found
+# in and how many of their rows have it
+def search_titles(query, kind=None, limit=20):
+    from search import SearchIndex
+
+    index = SearchIndex.load(SEARCH_PATH)
+    for doc in index.search(query, kind, limit):
+        groups = Counter(key for key, _ in index.locate(doc))
+        print(json.dumps([*doc[:-1], dict(groups)], ensure_ascii=False))
+
+
+def row_hash(row):
+    data = json.dumps(row, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(data.encode()).hexdigest()
+
+
+def group_key(row):
+    prov = row["Proveniens"]
+    if not prov:
+        return None
+    ls = row.get("Landskap", "")
+    return f"{prov} | {ls}"
+
+
+# Groups rows by "Proveniens | Landskap". Groups whose rows and coords
+# are the same as in the previous build are reused as they are.
+def group_rows(hitta, hashes, previous=None, previous_members=None):
+    previous = previous or {}
+    previous_members = previous_members or {}
+
+    members = {}
+    rows = {}
+    for row, h in zip(hitta, hashes):
+        key = group_key(row)
+        if not key:
             continue
-        ls = row.get("Landskap", "")
-        key = f"{prov} | {ls}"
-        if key not in grouped:
-            # randomly move coords a little bit
-            coords = [
-                (c[0] + random.uniform(-0.01, 0.01), c[1] + random.uniform(-0.01, 0.01))
-                for c in row["coords"]
-            ]
-            grouped[key] = {"coords": coords, "rows": []}
+        if key not in members:
+            members[key] = {
+                "rows": [],
+                "origin": [list(c) for c in row["coords"]],
+            }
+            rows[key] = []
+        members[key]["rows"].append(h)
+        rows[key].append(row)
+
+    # move groups at the same place apart
+    displaced = displace_groups(
+        {key: group["origin"] for key, group in members.items()}
+    )
 
-        grouped[key]["rows"].append(row)
+    grouped = {}
+    for key, group in members.items():
+        coords = round_coords(displaced[key])
+        old = previous.get(key)
+        if old and old["coords"] == coords and previous_members.get(key) == group:
+            grouped[key] = old
+        else:
+            grouped[key] = {"coords": coords, "rows": rows[key]}
 
-    with open("vastgotalatar/public/hitta.json", "w") as f:
-        json.dump(grouped, f, ensure_ascii=False)
+    return grouped, members
+
+
+# The previous build's manifest, if it can be built on. Groups read back
+# from the compact format have lost their rows' own coords, so a build
+# in the other format starts over.
+def load_manifest(compact=False):
+    try:
+        with open(MANIFEST_PATH) as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return None
+
+    if manifest.get("version") != MANIFEST_VERSION or not os.path.exists(HITTA_PATH):
+        return None
+    if manifest.get("format") != output_format(compact):
+        print("output format changed, rebuilding everything")
+        return None
+    return manifest
+
+
+def output_format(compact):
+    return "compact-1" if compact else "plain"
+
+
+def save_manifest(hitta, hashes, members, compact=False):
+    manifest = {
+        "version": MANIFEST_VERSION,
+        "format": output_format(compact),
+        "rows": {
+            h: {"coords": row["coords"], "filter": row["filter"]}
+            for row, h in zip(hitta, hashes)
+        },
+        "groups": members,
+    }
+    with open(MANIFEST_PATH, "w") as f:
+        json.dump(manifest, f, ensure_ascii=False)
 
 
 def cleanup_proveniens(p):
@@ -288,106 +666,154 @@ def first_if_close(part_locs):
 
 
 def is_close(p1, p2):
+    from geopy.distance import geodesic
+
     return geodesic(p1, p2).km < 12
 
 
-def is_in_bounds(p, bounds):
-    min_lat = bounds[0].latitude
-    max_lat = bounds[1].latitude
-    if min_lat > max_lat:
-        min_lat, max_lat = max_lat, min_lat
-    min_long = bounds[0].longitude
-    max_long = bounds[1].longitude
-    if min_long > max_long:
-        min_long, max_long = max_long, min_long
-
-    return min_lat <= p.latitude <= max_lat and min_long < p.longitude < max_long
-
-
-def geocode_lantmateriet(prov, ls):
-    # curl 'https://minkarta.lantmateriet.se/api/searchservice/searchinput?&searchtext=K%C3%A4llby' | jq .
-    # {
-    #   "antalsokresultat": 147,
-    #   "sokresultat": [
-    #     {
-    #       "typ": "ORTNAMN",
-    #       "position": {
-    #         "east": 401378,
-    #         "north": 6487224
-    #       },
-    #       "id": "4328929",
-    #       "headertext": "Källby",
-    #       "subtext": "Götene | Tätort"
-    #     },
-    #     {
-    #       "typ": "ORTNAMN",
-    #       "position": {
-    #         "east": 402866,
-    #         "north": 6486659
-    #       },
-    #       "id": "4272100",
-    #       "headertext": "Källby",
-    #       "subtext": "Götene | Bebyggelse"
-    #     },
-    #
-    # filter to exclude typ=ADRESS
-    #
-    # from pyproj import Transformer
-    # transformer = Transformer.from_crs("EPSG:3006", "EPSG:4326")
-    # lat, lng = transformer.transform(401378, 6487224)
-
-    # only query by prov, and use ls shapes to determine if a place is
-    # within landskap
-    #
-    # import geopandas as gpd
-    # from shapely.geometry import Point
-    #
-    # # Read GeoJSON
-    # gdf = gpd.read_file('polygon.geojson')
-    #
-    # point = Point(longitude, latitude)
-    # is_inside = gdf.geometry.contains(point).any()
-    #
-    # if there are more than one comma-separated prov, first search
-    # all of them. if there's no result, search each one individually
-    # and compare each search result if they're within 12km of each
-    # other to find clusters. only look for immediate next neighbors,
-    # e.g. Källebäcken, Gustav Adolf, Habo, Herrestad, Uddevalla
-    #
-    # if one of the comma-separated provs is a landskap as in
-    # "Fagerhult, Habo, Västergötland, Uddevalla, Bohuslän", recursively call
-    # geocode_lantmateriet("Fagerhult, Habo", "Västergötland"),
-    # geocode_lantmateriet("Uddevalla", "Bohuslän")
-    #
-    # lantmateriet doesnt fix spelling mistakes, so rename
-    # bovallsstrand to bovallstrand, etc. log all single places with no results
-
-
-    pass
+def geocode_lantmateriet(prov, ls) -> list[Location]:
+    # Offline lookup in a downloaded Lantmäteriet gazetteer (see
+    # gazetteer.py). Only prov is searched; ls is checked against the
+    # landskap polygons.
+    gaz = get_gazetteer()
+    landskap_index = get_landskap()
+    parts = split(prov)
+
+    # "Fagerhult, Habo, Västergötland, Uddevalla, Bohuslän" is geocoded
+    # as "Fagerhult, Habo" in Västergötland and "Uddevalla" in Bohuslän
+    if len(parts) > 1 and any(p in landskap_index for p in parts):
+        locs = []
+        cur = []
+        for p in parts:
+            if p in landskap_index:
+                if cur:
+                    locs += geocode_lantmateriet(", ".join(cur), p)
+                cur = []
+            else:
+                cur.append(p)
+        if cur:
+            locs += geocode_lantmateriet(", ".join(cur), ls)
+        return locs
+
+    landskap = [ls] if ls in landskap_index else REGION_LANDSKAP
+
+    hits = gaz.search(fix_spelling(prov), landskap)
+    if hits:
+        return [hits[0]]
+
+    if len(parts) == 1:
+        print("no gazetteer hits", prov, ls)
+        return []
+
+    # search each part individually and cluster immediate neighbours
+    # within 12km, e.g. "Källebäcken, Gustav Adolf, Habo, Herrestad,
+    # Uddevalla" gives one location near Habo and one near Uddevalla
+    clusters = []
+    for p in parts:
+        hits = gaz.search(fix_spelling(p), landskap)
+        if not hits:
+            print("no gazetteer hits", p, ls)
+            continue
+        prev = clusters[-1][-1] if clusters else None
+        close = [h for h in hits if prev and is_close(prev.point, h.point)]
+        if close:
+            clusters[-1].append(close[0])
+        else:
+            clusters.append([hits[0]])
+
+    return [c[0] for c in clusters]
+
+
+def fix_spelling(prov):
+    # the gazetteer doesn't correct spelling mistakes in the catalog
+    key = prov.lower()
+    return SPELLING_FIXES.get(key, prov)
+
+
+@functools.cache
+def get_gazetteer():
+    from gazetteer import Gazetteer
+
+    return Gazetteer(os.environ.get("GAZETTEER_PATH", "ortnamn.jsonl"), get_landskap())
+
+
+# The names geocode_lantmateriet searches the gazetteer for: each part
+# of every proveniens, with the spelling fixed
+def gazetteer_names():
+    landskap_index = get_landskap()
+    names = set()
+    for row in load_hitta_rows():
+        prov = row["Proveniens"]
+        if not isinstance(prov, str):
+            continue
+        for part in cleanup_parens_parts(split(cleanup_proveniens(prov))):
+            for name in split(part):
+                if name and name not in landskap_index:
+                    names.add(fix_spelling(name))
+    return names
+
+
+def fetch_gazetteer(path, rate=2.0):
+    from gazetteer import fetch_gazetteer
+
+    names = gazetteer_names()
+    entries = fetch_gazetteer(names, path, rate=rate)
+    print(f"{entries} places for {len(names)} names in {path}")
+
 
 def geocode(prov, ls):
+    if GEOCODER == "lantmateriet":
+        locs = geocode_lantmateriet(prov, ls)
+        return locs[0] if locs else None
+
     query = f"{prov}, {ls}".strip(" ,")
 
-    if query in CACHE:
-        locs = CACHE[query]
+    cache = get_cache()
+    locs = cache.get(query)
+    if locs is None:
+        if PENDING is not None:
+            PENDING.add(query)
+            return None
 
-    else:
+        from geopy.exc import GeocoderQueryError
+
+        count("cache_misses")
         print(query)
         try:
-            locs = gmaps.geocode(query, exactly_one=False, bounds=BOUNDS)
+            locs = get_geocoder().geocode(
+                query, exactly_one=False, bounds=get_bounds()
+            )
+            locs = locs or []
         except GeocoderQueryError:
             print("query error", query)
             locs = []
-        cache(query, locs)
+        cache.put(query, locs)
+    else:
+        count("cache_hits")
 
     if not locs:
+        count("no_results")
         return None
 
-    for loc in locs:
-        if is_in_bounds(loc, BOUNDS):
+    # prefer a candidate inside the requested landskap, then one
+    # anywhere in the region, which is counted and logged separately
+    # since it can be a namesake in the neighbouring landskap
+    landskap_index = get_landskap()
+    located = landskap_index.classify_locations(locs)
+    wanted = [ls] if ls in landskap_index else REGION_LANDSKAP
+    for loc, loc_ls in zip(locs, located):
+        if loc_ls in wanted:
+            return loc
+    for loc, loc_ls in zip(locs, located):
+        if loc_ls in REGION_LANDSKAP:
+            count("region_fallback")
+            if PENDING is None:
+                print("region fallback", query, "in", loc_ls)
             return loc
 
+    count("out_of_bounds")
     if ls:
+        count("fallbacks")
         return geocode(prov, "")
 
     if prov == "Askersund":
@@ -396,31 +822,197 @@ def geocode(prov, ls):
     return None
 
 
-def cache(query, loc):
-    CACHE[query] = loc
-    with open("loc.cache", "wb") as f:
-        pickle.dump(CACHE, f)
+# Counts a geocode outcome in the report, except in the dry runs of
+# prefetch_locations, which look up the same queries as the real run.
+def count(name):
+    if PENDING is None:
+        REPORT.count(name)
+
+
+def prefetch_locations(rows, geocoder=None, workers=8, rate=40):
+    global PENDING
+    from geocoding import geocode_batch
+
+    if geocoder is None and GEOCODER_BACKEND == "replay" and REPLAY_MISS != "google":
+        rate = None
+
+    # Dry-run get_locations over every distinct (prov, landskap) to
+    # collect the cache misses, resolve them concurrently, and repeat
+    # until the fallback queries that depend on earlier results are
+    # resolved too.
+    places = {(row["Proveniens"], row["Landskap"]) for row in rows}
+    while True:
+        PENDING = set()
+        try:
+            for prov, ls in places:
+                get_locations(prov, ls)
+        finally:
+            pending, PENDING = PENDING, None
+
+        if not pending:
+            return
+
+        REPORT.count("cache_misses", len(pending))
+        resolved = 0
+        for query, locs in geocode_batch(
+            geocoder or get_geocoder(),
+            sorted(pending),
+            bounds=get_bounds(),
+            workers=workers,
+            rate=rate,
+        ):
+            get_cache().put(query, locs)
+            resolved += 1
+        REPORT.count("prefetched", resolved)
+
+        if not resolved:
+            return
+
+
+# Heavy resources are created on first use, so that importing this
+# module (e.g. for normalize_instrument) stays cheap.
+
+
+@functools.cache
+def get_gmaps():
+    from geopy.geocoders import GoogleV3
+
+    return GoogleV3(os.environ["GMAPS_API_KEY"])
+
+
+@functools.cache
+def get_geocoder():
+    from geocoding import NoResultsGeocoder, RecordingGeocoder, ReplayGeocoder
+
+    # only requests to the API are counted, not replayed responses
+    def gmaps():
+        return CountingGeocoder(get_gmaps(), REPORT)
+
+    if GEOCODER_BACKEND == "google":
+        return gmaps()
+    if GEOCODER_BACKEND == "record":
+        return RecordingGeocoder(gmaps(), GEOCODE_RECORDING)
+    if GEOCODER_BACKEND == "replay":
+        fallback = None
+        if REPLAY_MISS == "empty":
+            fallback = NoResultsGeocoder()
+        elif REPLAY_MISS == "google":
+            fallback = gmaps()
+        return ReplayGeocoder(GEOCODE_RECORDING, fallback)
+    raise ValueError(f"Unknown geocoder backend: {GEOCODER_BACKEND}")
+
+
+def configure_geocoder(backend=None, recording=None, on_miss=None):
+    global GEOCODER_BACKEND, GEOCODE_RECORDING, REPLAY_MISS
+
+    GEOCODER_BACKEND = backend or GEOCODER_BACKEND
+    GEOCODE_RECORDING = recording or GEOCODE_RECORDING
+    REPLAY_MISS = on_miss or REPLAY_MISS
+    get_geocoder.cache_clear()
+
+
+def configure_cache(ttl=None):
+    global GEOCODE_CACHE_TTL
+
+    GEOCODE_CACHE_TTL = ttl if ttl is not None else GEOCODE_CACHE_TTL
+    get_cache.cache_clear()
+
+
+@functools.cache
+def get_cache():
+    return load_cache(None if GEOCODE_CACHE_TTL is None else GEOCODE_CACHE_TTL * DAY)
+
+
+@functools.cache
+def get_landskap():
+    from landskap import LandskapIndex
+
+    return LandskapIndex(LANDSKAP_PATH)
+
 
+@functools.cache
+def get_bounds():
+    landskap_bounds = load_landskap_bounds()
+    return combined_bounds(
+        *[landskap_bounds[ls] for ls in REGION_LANDSKAP],
+        padding=0.3,
+    )
+
+
+def load_cache(ttl=None):
+    if READ_ONLY_CACHE:
+        return GeocodeCache(GEOCODE_CACHE_PATH, ttl=ttl, read_only=True)
+    cache = GeocodeCache(GEOCODE_CACHE_PATH, ttl=ttl)
+    # one-time import of the old whole-file pickle cache
+    cache.migrate_pickle("loc.cache")
+    return cache
+
+
+# The bounds are kept in a sidecar with the size, mtime and sha256 of the
+# GeoJSON, like the catalog snapshot: the polygons are only hashed when
+# the size or mtime moved, and only read again when the hash did too.
+def load_landskap_bounds():
+    stat = os.stat(LANDSKAP_PATH)
+    key = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+    try:
+        with open(LANDSKAP_BOUNDS_PATH) as f:
+            sidecar = json.load(f)
+    except FileNotFoundError:
+        sidecar = None
 
-def load_cache():
-    with open("loc.cache", "rb") as f:
-        return pickle.load(f)
+    if sidecar and all(sidecar.get(k) == v for k, v in key.items()):
+        return {ls: bounds_to_points(b) for ls, b in sidecar["bounds"].items()}
 
+    with open(LANDSKAP_PATH, "rb") as f:
+        source_hash = hashlib.sha256(f.read()).hexdigest()
+    if not sidecar or sidecar["source_sha256"] != source_hash:
+        sidecar = {"source_sha256": source_hash, "bounds": compute_landskap_bounds()}
+    sidecar.update(key)
+    with open(LANDSKAP_BOUNDS_PATH, "w") as f:
+        json.dump(sidecar, f, ensure_ascii=False)
 
+    return {ls: bounds_to_points(b) for ls, b in sidecar["bounds"].items()}
+
+
+# (min_lng, min_lat, max_lng, max_lat) per landskap, read straight from
+# the GeoJSON coordinates
 def compute_landskap_bounds():
-    landskap = gpd.read_file("svenska-landskap.geo.json")
-    bounds_dict = {
-        row["landskap"]: bounds_to_points(row.geometry.bounds)
-        for _, row in landskap.iterrows()
-    }
+    with open(LANDSKAP_PATH) as f:
+        features = json.load(f)["features"]
+
+    bounds_dict = {}
+    for feat in features:
+        geometry = feat["geometry"]
+        polygons = geometry["coordinates"]
+        if geometry["type"] == "Polygon":
+            polygons = [polygons]
+
+        lngs = []
+        lats = []
+        for polygon in polygons:
+            for ring in polygon:
+                for lng, lat in ring:
+                    lngs.append(lng)
+                    lats.append(lat)
+        bounds_dict[feat["properties"]["landskap"]] = [
+            min(lngs),
+            min(lats),
+            max(lngs),
+            max(lats),
+        ]
     return bounds_dict
 
 
 def bounds_to_points(b):
+    from geopy.point import Point
+
     return (Point(b[3], b[0]), Point(b[1], b[2]))
 
 
 def combined_bounds(*bs, padding=0.0):
+    from geopy.point import Point
+
     min_y = float("inf")
     min_x = float("inf")
     max_y = float("-inf")
@@ -442,11 +1034,224 @@ def combined_bounds(*bs, padding=0.0):
     )
 
 
-CACHE = load_cache()
-LANDSKAP_BOUNDS = compute_landskap_bounds()
-BOUNDS = combined_bounds(
-    LANDSKAP_BOUNDS["Västergötland"],
-    LANDSKAP_BOUNDS["Bohuslän"],
-    LANDSKAP_BOUNDS["Dalsland"],
-    padding=0.3,
-)
+def warm_cache(workers=8, rate=40):
+    prefetch_locations(load_hitta_rows(), workers=workers, rate=rate)
+
+
+# Writes the cache as a recording, so that builds can be replayed from
+# what's been geocoded so far
+def export_recording(path):
+    with open(path, "w") as f:
+        for query, results in get_cache().entries():
+            entry = {"query": query, "results": results}
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    print(f"{len(get_cache())} queries written to {path}")
+
+
+def invalidate_cache(query=None, older_than=None):
+    removed = get_cache().invalidate(
+        query, None if older_than is None else older_than * DAY
+    )
+    print(f"{removed} cache entries removed")
+
+
+def print_stats():
+    stats = get_cache().stats()
+    print(f"cache entries:      {stats['entries']}")
+    print(f"  without results:  {stats['empty']}")
+    if stats["entries"]:
+        print(f"  oldest:           {time.ctime(stats['oldest'])}")
+        print(f"  newest:           {time.ctime(stats['newest'])}")
+
+
+def check_import_time():
+    elapsed = float(
+        subprocess.check_output(
+            [
+                sys.executable,
+                "-c",
+                "import time; t = time.perf_counter(); import process; "
+                "print(time.perf_counter() - t)",
+            ],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        )
+    )
+    print(
+        f"import process: {elapsed * 1000:.0f} ms "
+        f"(budget {IMPORT_TIME_BUDGET * 1000:.0f} ms)"
+    )
+    return elapsed <= IMPORT_TIME_BUDGET
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build the Västgötalåtar map data")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build = subparsers.add_parser("build", help="build vastgotalatar/public/hitta.json")
+    build.add_argument(
+        "--serial", action="store_true", help="geocode cache misses one at a time"
+    )
+    build.add_argument(
+        "--incremental",
+        action="store_true",
+        help="only process rows added or changed since the last build",
+    )
+    build.add_argument(
+        "--shard-by",
+        choices=["tile", "landskap"],
+        default="tile",
+        help="how to split the rows into on-demand shards",
+    )
+    build.add_argument(
+        "--no-snapshot",
+        action="store_true",
+        help="read the Excel catalog instead of its cached snapshot",
+    )
+    build.add_argument(
+        "--no-media",
+        action="store_true",
+        help="don't link rows to visarkiv audio",
+    )
+    build.add_argument(
+        "--processes",
+        type=int,
+        default=1,
+        help="resolve locations in this many worker processes (0: one per core)",
+    )
+    build.add_argument(
+        "--compact",
+        action="store_true",
+        help="write hitta.json and the shards with interned values (see export.py)",
+    )
+    build.add_argument(
+        "--report",
+        default=REPORT_PATH,
+        help="where to write the timings and geocode counts of the build",
+    )
+    build.add_argument(
+        "--profile",
+        choices=["cprofile", "pyinstrument"],
+        help="profile the build",
+    )
+    build.add_argument(
+        "--profile-out",
+        help="where to write the profile (build.prof or build-profile.html)",
+    )
+    warm = subparsers.add_parser(
+        "warm-cache", help="geocode every catalog location into the cache"
+    )
+    for p in [build, warm]:
+        p.add_argument(
+            "--workers", type=int, default=8, help="concurrent geocode requests"
+        )
+        p.add_argument(
+            "--rate", type=float, default=40, help="geocode requests per second"
+        )
+        p.add_argument(
+            "--geocoder-backend",
+            choices=["google", "record", "replay"],
+            help="where geocode results come from (default $GEOCODER_BACKEND "
+            "or google)",
+        )
+        p.add_argument(
+            "--recording",
+            help="the JSONL file to record to or replay from "
+            "(default $GEOCODE_RECORDING or geocode-recording.jsonl)",
+        )
+        p.add_argument(
+            "--on-miss",
+            choices=["fail", "empty", "google"],
+            help="what a replay does with a query that isn't recorded "
+            "(default $REPLAY_MISS or fail)",
+        )
+        p.add_argument(
+            "--cache-ttl",
+            type=float,
+            metavar="DAYS",
+            help="geocode cached results older than this again "
+            "(default $GEOCODE_CACHE_TTL or never)",
+        )
+
+    subparsers.add_parser("stats", help="print geocode cache statistics")
+    invalidate = subparsers.add_parser(
+        "invalidate-cache", help="remove entries from the geocode cache"
+    )
+    which = invalidate.add_mutually_exclusive_group(required=True)
+    which.add_argument("--query", help='one query, e.g. "Källby, Västergötland"')
+    which.add_argument(
+        "--older-than", type=float, metavar="DAYS", help="entries older than this"
+    )
+    which.add_argument("--all", action="store_true", help="every entry")
+    export = subparsers.add_parser(
+        "export-recording", help="write the geocode cache as a replayable recording"
+    )
+    export.add_argument("path", nargs="?", default=GEOCODE_RECORDING)
+    subparsers.add_parser("match", help="print how many rows match visarkiv records")
+    search = subparsers.add_parser(
+        "search", help="search the titles and tracks of the search index"
+    )
+    search.add_argument("query")
+    search.add_argument(
+        "--kind", choices=["h", "v"], help="only hitta titles or visarkiv tracks"
+    )
+    search.add_argument("--limit", type=int, default=20)
+    subparsers.add_parser("import-time", help="check the import time budget")
+    gazetteer = subparsers.add_parser(
+        "fetch-gazetteer",
+        help="download the Lantmäteriet place names of the catalog for "
+        "GEOCODER=lantmateriet",
+    )
+    gazetteer.add_argument(
+        "path", nargs="?", default=os.environ.get("GAZETTEER_PATH", "ortnamn.jsonl")
+    )
+    gazetteer.add_argument(
+        "--rate", type=float, default=2.0, help="search requests per second"
+    )
+
+    args = parser.parse_args(argv)
+
+    if args.command in ["build", "warm-cache"]:
+        configure_geocoder(args.geocoder_backend, args.recording, args.on_miss)
+        configure_cache(args.cache_ttl)
+
+    if args.command == "build":
+        build_data = functools.partial(
+            create_hitta_data,
+            batch=not args.serial,
+            workers=args.workers,
+            rate=args.rate,
+            incremental=args.incremental,
+            shard_by=args.shard_by,
+            use_snapshot=not args.no_snapshot,
+            media=not args.no_media,
+            report_path=args.report,
+            compact=args.compact,
+            processes=args.processes or os.cpu_count(),
+        )
+        if args.profile:
+            out = args.profile_out or PROFILE_PATHS[args.profile]
+            profiled(build_data, args.profile, out)
+            print(f"profile written to {out}")
+        else:
+            build_data()
+    elif args.command == "warm-cache":
+        warm_cache(workers=args.workers, rate=args.rate)
+    elif args.command == "stats":
+        print_stats()
+    elif args.command == "invalidate-cache":
+        invalidate_cache(args.query, args.older_than)
+    elif args.command == "export-recording":
+        export_recording(args.path)
+    elif args.command == "match":
+        print_match_stats()
+    elif args.command == "search":
+        search_titles(args.query, kind=args.kind, limit=args.limit)
+    elif args.command == "import-time":
+        if not check_import_time():
+            sys.exit(1)
+    elif args.command == "fetch-gazetteer":
+        fetch_gazetteer(args.path, rate=args.rate)
+
+
+if __name__ == "__main__":
+    main()
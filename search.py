@@ -0,0 +1,174 @@
+import bisect
+import json
+import re
+
+from export import write_json
+from text import fold
+
+
+# A static full-text index over the tune titles of the hitta catalog and
+# the track listings of the visarkiv records, written next to the map
+# data and queried both here and in TuneMap.js:
+#
+#   {"groups": [["Källby | Västergötland", 12], ...],
+#    "docs": [["h", "Polska efter Lapp-Nils", "Polska", [40, 3]],
+#             ["v", "Lilla vallpiga dra på dig små skorna", "SVA BA 0614",
+#              1, "https://.../SVABA0614.mp3", [812]], ...],
+#    "terms": ["dig", "dra", "efter", "lapp", ...],
+#    "postings": [[3, 1, 12], ...]}
+#
+# Terms are folded (lowercase, no diacritics, so "vallpiga" finds
+# "Vallpiga" and "sma" finds "små") and sorted, so that a prefix is a
+# range of terms. Each posting list holds the ids of the documents with
+# that term as differences to the previous id, which keeps the numbers
+# and the file small.
+#
+# The last item of a document is the rows it was found in: the hitta
+# rows with that title, or those linked to the track's recording. Rows
+# are numbered as in facets.json, in the order of the groups and of the
+# rows within them, and stored as differences too. "groups" has the key
+# and row count of each group, so that a row id tells where the tune is.
+
+
+def tokenize(s):
+    return re.findall(r"[a-z0-9]+", fold(s))
+
+
+# "01. Lilla vallpiga dra på dig små skorna, Liten vallpiga;02. ..." ->
+# [(1, "Lilla vallpiga dra på dig små skorna, Liten vallpiga"), ...]
+def split_tracks(innehall):
+    tracks = []
+    for part in (innehall or "").split(";"):
+        match = re.match(r"\s*(\d+)\.\s*(.*)", part)
+        if match:
+            number, title = int(match.group(1)), match.group(2).strip()
+        else:
+            number, title = None, part.strip()
+        if title:
+            tracks.append((number, title))
+    return tracks
+
+
+def grouped_rows(grouped):
+    return (row for group in grouped.values() for row in group["rows"])
+
+
+def hitta_docs(grouped):
+    # one document per distinct title and genre, which is what the map
+    # filters on
+    docs = {}
+    for row_id, row in enumerate(grouped_rows(grouped)):
+        title = row.get("Titel eller låtnamn")
+        if title:
+            key = (str(title), row.get("Låttyp eller visgenre"))
+            docs.setdefault(key, []).append(row_id)
+    keys = sorted(docs, key=lambda key: (key[0], key[1] or ""))
+    return [("h", title, genre, docs[title, genre]) for title, genre in keys]
+
+
+def visarkiv_docs(records, grouped):
+    linked = {}
+    for row_id, row in enumerate(grouped_rows(grouped)):
+        if row.get("media_url"):
+            linked.setdefault(row["media_url"], []).append(row_id)
+
+    docs = []
+    for record in records:
+        media_url = record.get("media_url")
+        rows = linked.get(media_url, []) if media_url else []
+        for number, title in split_tracks(record.get("innehall")):
+            docs.append(
+                ("v", title, record["accessionsnummer"], number, media_url, rows)
+            )
+    return docs
+
+
+def doc_text(doc):
+    # titles and genres of hitta rows, titles of visarkiv tracks
+    return f"{doc[1]} {doc[2] or ''}" if doc[0] == "h" else doc[1]
+
+
+def build_index(grouped, records=()):
+    docs = hitta_docs(grouped) + visarkiv_docs(records, grouped)
+
+    postings = {}
+    for i, doc in enumerate(docs):
+        for term in set(tokenize(doc_text(doc))):
+            postings.setdefault(term, []).append(i)
+
+    terms = sorted(postings)
+    return {
+        "groups": [[key, len(group["rows"])] for key, group in grouped.items()],
+        "docs": [[*doc[:-1], delta_encode(doc[-1])] for doc in docs],
+        "terms": terms,
+        "postings": [delta_encode(postings[term]) for term in terms],
+    }
+
+
+def delta_encode(ids):
+    return [b - a for a, b in zip([0] + ids, ids)]
+
+
+def delta_decode(deltas):
+    ids = []
+    total = 0
+    for d in deltas:
+        total += d
+        ids.append(total)
+    return ids
+
+
+class SearchIndex:
+    def __init__(self, data):
+        self.groups = data["groups"]
+        self.docs = data["docs"]
+        self.terms = data["terms"]
+        self.postings = data["postings"]
+        # the first row id of each group
+        self.offsets = [0]
+        for _, rows in self.groups:
+            self.offsets.append(self.offsets[-1] + rows)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            return cls(json.load(f))
+
+    def prefix_range(self, prefix):
+        lo = bisect.bisect_left(self.terms, prefix)
+        hi = bisect.bisect_left(self.terms, prefix + "\uffff")
+        return lo, hi
+
+    # Every word of the query is a prefix, and a document has to match
+    # all of them: "vallp lill" finds "Lilla vallpiga".
+    def search_ids(self, query):
+        result = None
+        for word in tokenize(query):
+            lo, hi = self.prefix_range(word)
+            ids = set()
+            for i in range(lo, hi):
+                ids.update(delta_decode(self.postings[i]))
+            result = ids if result is None else result & ids
+            if not result:
+                return []
+        return sorted(result or ())
+
+    def search(self, query, kind=None, limit=None):
+        docs = [self.docs[i] for i in self.search_ids(query)]
+        if kind:
+            docs = [doc for doc in docs if doc[0] == kind]
+        return docs[:limit]
+
+    # (group key, row index in the group) of each row of a document
+    def locate(self, doc):
+        located = []
+        for row_id in delta_decode(doc[-1]):
+            group = bisect.bisect_right(self.offsets, row_id) - 1
+            located.append((self.groups[group][0], row_id - self.offsets[group]))
+        return located
+
+
+def write_search_index(path, grouped, records=()):
+    index = build_index(grouped, records)
+    write_json(path, index)
+    return index
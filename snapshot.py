@@ -0,0 +1,126 @@
+import datetime
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+
+# Caches a DataFrame built from `source` as an uncompressed Feather file
+# next to a small .meta.json with the source's size, mtime and sha256.
+# The snapshot is reused as long as the source is unchanged: the mtime
+# is checked first, and the hash only when the mtime moved.
+def load_snapshot(source, path, read):
+    meta_path = path + ".meta.json"
+    stat = os.stat(source)
+
+    try:
+        with open(meta_path) as f:
+            meta = json.load(f)
+    except FileNotFoundError:
+        meta = None
+
+    if meta and os.path.exists(path):
+        if meta["mtime_ns"] == stat.st_mtime_ns and meta["size"] == stat.st_size:
+            return read_snapshot(path)
+
+        digest = file_sha256(source)
+        if digest == meta["sha256"]:
+            meta["mtime_ns"] = stat.st_mtime_ns
+            write_meta(meta_path, meta)
+            return read_snapshot(path)
+    else:
+        digest = file_sha256(source)
+
+    df = read()
+    write_snapshot(df, path)
+    write_meta(
+        meta_path,
+        {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": digest},
+    )
+    return df
+
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def write_meta(path, meta):
+    with open(path, "w") as f:
+        json.dump(meta, f)
+
+
+# Columns that mix types (e.g. years as both strings and ints) can't be
+# stored as a single Arrow type, so they're stored as JSON strings and
+# decoded on load. Values JSON has no type for are stored with theirs,
+# e.g. {"$type": "time", "value": "10:30:00"}, and read back as they were.
+def write_snapshot(df, path):
+    columns = {}
+    json_columns = []
+    for name in df.columns:
+        try:
+            columns[name] = pa.array(df[name], from_pandas=True)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            columns[name] = pa.array(
+                [json.dumps(v, ensure_ascii=False, default=to_python) for v in df[name]]
+            )
+            json_columns.append(name)
+
+    table = pa.table(columns).replace_schema_metadata(
+        {"json_columns": json.dumps(json_columns)}
+    )
+    # uncompressed, so that it can be memory-mapped
+    feather.write_feather(table, path, compression="uncompressed")
+
+
+def read_snapshot(path):
+    table = feather.read_table(path, memory_map=True)
+    json_columns = json.loads(table.schema.metadata[b"json_columns"])
+    df = table.to_pandas()
+    for name in json_columns:
+        df[name] = [json.loads(v, object_hook=from_python) for v in df[name]]
+    return df
+
+
+# Values json can't encode: numpy scalars, and the dates and times that
+# read_excel leaves in columns of mixed types
+def to_python(v):
+    if v is pd.NaT:
+        return {TYPE_KEY: "NaT"}
+    if isinstance(v, np.datetime64):
+        v = pd.Timestamp(v)
+    for kind, cls in DATE_TYPES.items():
+        if isinstance(v, cls):
+            return {TYPE_KEY: kind, "value": v.isoformat()}
+    if hasattr(v, "item"):
+        return v.item()
+    return str(v)
+
+
+def from_python(d):
+    kind = d.get(TYPE_KEY)
+    if kind == "NaT":
+        return pd.NaT
+    if kind == "Timestamp":
+        # keeps the nanoseconds that fromisoformat would drop
+        return pd.Timestamp(d["value"])
+    if kind in DATE_TYPES:
+        return DATE_TYPES[kind].fromisoformat(d["value"])
+    return d
+
+
+TYPE_KEY = "$type"
+# subclasses first
+DATE_TYPES = {
+    "Timestamp": pd.Timestamp,
+    "datetime": datetime.datetime,
+    "date": datetime.date,
+    "time": datetime.time,
+}
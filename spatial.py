@@ -0,0 +1,81 @@
+import hashlib
+import math
+import random
+from collections import defaultdict
+
+
+# degrees of latitude, about 550 m
+MIN_DISTANCE = 0.005
+
+
+class SpatialHash:
+    def __init__(self, cell_size):
+        self.cell_size = cell_size
+        self.cells = defaultdict(list)
+
+    def cell(self, x, y):
+        return (math.floor(x / self.cell_size), math.floor(y / self.cell_size))
+
+    def insert(self, x, y, item=None):
+        self.cells[self.cell(x, y)].append((x, y, item))
+
+    def near(self, x, y, radius):
+        cx, cy = self.cell(x, y)
+        r = math.ceil(radius / self.cell_size)
+        for i in range(cx - r, cx + r + 1):
+            for j in range(cy - r, cy + r + 1):
+                for px, py, item in self.cells.get((i, j), ()):
+                    if (px - x) ** 2 + (py - y) ** 2 < radius**2:
+                        yield px, py, item
+
+    def collides(self, x, y, radius):
+        return next(self.near(x, y, radius), None) is not None
+
+
+# Spreads out group coordinates that are closer than min_distance to
+# each other, and leaves all other points where they are. Groups are
+# placed in key order and colliding points are moved to the first free
+# slot on rings around their origin, starting at an angle seeded by the
+# group key, so the output only depends on the input. Points that share
+# an origin resume at the slot after the one the previous point took,
+# instead of going through the taken rings again.
+def displace_groups(origins, min_distance=MIN_DISTANCE):
+    grid = SpatialHash(min_distance)
+    cursors = {}
+    displaced = {}
+    for key in sorted(origins):
+        rng = random.Random(hashlib.sha1(key.encode()).digest())
+        coords = []
+        for lat, lng in origins[key]:
+            # equirectangular, so distances are roughly isotropic
+            scale = math.cos(math.radians(lat))
+            angle = rng.uniform(0, 2 * math.pi)
+            origin = (round(lat, 7), round(lng, 7))
+            slot = cursors.get(origin, 0)
+            for x, y in ring_slots(lng * scale, lat, min_distance, angle, slot):
+                slot += 1
+                if not grid.collides(x, y, min_distance):
+                    break
+            cursors[origin] = slot
+            grid.insert(x, y)
+            coords.append([y, x / scale])
+        displaced[key] = coords
+    return displaced
+
+
+# The origin and then the slots on rings of 6, 12, 18, ... points around
+# it, from the start-th slot on.
+def ring_slots(x, y, step, angle, start=0):
+    if start == 0:
+        yield x, y
+        start = 1
+    ring, i = 1, start - 1
+    while i >= 6 * ring:
+        i -= 6 * ring
+        ring += 1
+    while True:
+        n = 6 * ring
+        for i in range(i, n):
+            a = angle + 2 * math.pi * i / n
+            yield x + ring * step * math.cos(a), y + ring * step * math.sin(a)
+        ring, i = ring + 1, 0
@@ -0,0 +1,32 @@
+import os
+import shutil
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "benchmarks"), os.path.join(ROOT, "visarkiv")]
+
+import process  # noqa: E402
+from suite import FakeGeocoder  # noqa: E402
+
+CACHED = ["get_gmaps", "get_geocoder", "get_cache", "get_landskap", "get_bounds"]
+
+
+# A directory to build in, with the landskap polygons, a fresh geocode
+# cache and the fake geocoder of the benchmarks instead of GoogleV3
+@pytest.fixture
+def build_dir(tmp_path, monkeypatch):
+    for name in [process.LANDSKAP_PATH, process.LANDSKAP_BOUNDS_PATH]:
+        shutil.copy(os.path.join(ROOT, name), tmp_path / name)
+    os.makedirs(tmp_path / "vastgotalatar" / "public")
+    monkeypatch.chdir(tmp_path)
+    for name in CACHED:
+        getattr(process, name).cache_clear()
+    monkeypatch.setattr(process, "GEOCODER_BACKEND", "google")
+    monkeypatch.setattr(process, "GEOCODE_CACHE_TTL", None)
+    monkeypatch.setattr(process, "get_gmaps", FakeGeocoder)
+    yield tmp_path
+    monkeypatch.undo()
+    for name in CACHED:
+        getattr(process, name).cache_clear()
@@ -0,0 +1,22 @@
+import time
+
+import process
+from geocache import GeocodeCache
+
+
+def test_ttl_and_invalidate(build_dir):
+    cache = GeocodeCache(process.GEOCODE_CACHE_PATH)
+    cache.put("Källby, Västergötland", [], created=time.time() - 10 * process.DAY)
+    cache.put("Lerum, Västergötland", [])
+    cache.put("Tanum, Bohuslän", [])
+
+    process.configure_cache(5)
+    assert "Källby, Västergötland" not in process.get_cache()
+    assert "Lerum, Västergötland" in process.get_cache()
+
+    process.main(["invalidate-cache", "--older-than", "5"])
+    assert len(cache) == 2
+    process.main(["invalidate-cache", "--query", "Tanum, Bohuslän"])
+    assert len(cache) == 1
+    process.main(["invalidate-cache", "--all"])
+    assert len(cache) == 0
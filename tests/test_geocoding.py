@@ -0,0 +1,53 @@
+from collections import Counter
+
+from geopy.exc import GeocoderQueryError, GeocoderRateLimited, GeocoderTimedOut
+
+import geocoding
+from geocoding import geocode_batch
+from suite import FakeGeocoder
+
+
+# Fails each query the given number of times before answering like the
+# fake geocoder of the benchmarks
+class FlakyGeocoder(FakeGeocoder):
+    def __init__(self, failures):
+        super().__init__(miss_rate=0)
+        self.failures = failures
+        self.attempts = Counter()
+
+    def geocode(self, query, exactly_one=False, bounds=None):
+        self.attempts[query] += 1
+        errors = self.failures.get(query, [])
+        if self.attempts[query] <= len(errors):
+            raise errors[self.attempts[query] - 1]
+        return super().geocode(query, exactly_one=exactly_one, bounds=bounds)
+
+
+def test_geocode_batch_retries(monkeypatch):
+    delays = []
+    monkeypatch.setattr(geocoding.time, "sleep", delays.append)
+    monkeypatch.setattr(geocoding.random, "uniform", lambda a, b: a)
+
+    timeout = GeocoderTimedOut("timed out")
+    geocoder = FlakyGeocoder(
+        {
+            "Källby, Västergötland": [timeout, timeout],
+            "Tanum, Bohuslän": [GeocoderRateLimited("slow down", retry_after=7)],
+            "Bäckefors, Dalsland": [GeocoderQueryError("bad query")],
+            "Lerum, Västergötland": [timeout] * 4,
+        }
+    )
+    queries = list(geocoder.failures) + ["Borås, Västergötland"]
+
+    results = dict(geocode_batch(geocoder, queries, workers=1, rate=None, retries=3))
+
+    # retried after 1 and 2 s, after the server's retry-after, and not at
+    # all after a query error
+    assert delays == [1.0, 2.0, 7, 1.0, 2.0, 4.0]
+    assert results["Bäckefors, Dalsland"] == []
+    for query in ["Källby, Västergötland", "Tanum, Bohuslän", "Borås, Västergötland"]:
+        assert results[query] == FakeGeocoder(miss_rate=0).geocode(query)
+    # given up on after 1 + 3 attempts, and left out to be retried later
+    assert "Lerum, Västergötland" not in results
+    assert geocoder.attempts["Lerum, Västergötland"] == 4
+    assert geocoder.attempts["Bäckefors, Dalsland"] == 1
@@ -0,0 +1,35 @@
+import pandas as pd
+import pytest
+
+import process
+from suite import synthetic_rows
+
+
+def catalog(changed=False):
+    rows = synthetic_rows(1)
+    if changed:
+        for row in rows[::40]:
+            row["Titel eller låtnamn"] = f"{row['Titel eller låtnamn']} (ny)"
+        del rows[-25:]
+    return rows
+
+
+def build(monkeypatch, rows, **kwargs):
+    monkeypatch.setattr(process, "load_hitta_df", lambda *args: pd.DataFrame(rows))
+    process.create_hitta_data(**kwargs)
+    output = {}
+    for path in [process.HITTA_PATH, f"{process.SHARDS_DIR}/index.json"]:
+        with open(path) as f:
+            output[path] = f.read()
+    return output
+
+
+# An incremental build on top of a previous one, in the same or the
+# other format, writes what a full build of the new catalog does
+@pytest.mark.parametrize("previous", [False, True], ids=["from-plain", "from-compact"])
+@pytest.mark.parametrize("compact", [False, True], ids=["plain", "compact"])
+def test_incremental_equals_full(build_dir, monkeypatch, previous, compact):
+    build(monkeypatch, catalog(), compact=previous)
+    incremental = build(monkeypatch, catalog(changed=True), compact=compact, incremental=True)
+    full = build(monkeypatch, catalog(changed=True), compact=compact)
+    assert incremental == full
@@ -0,0 +1,88 @@
+import json
+import os
+import threading
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+from standin_server import StandinHandler
+from visarkiv.media import MediaFetcher, file_sha256
+
+AUDIO = "https://katalog.visarkiv.se/lib/views/rec/XrefThemes/Theme1/src/audio/"
+RECORD = {
+    "accessionsnummer": "SVA BA 0464",
+    "media_url": AUDIO + "fritt/SVA BA 1969/SVABA0464.mp3",
+}
+
+
+# standin_server.py serving tmp_path/served under /audio/
+@pytest.fixture
+def server(tmp_path):
+    served = tmp_path / "served"
+    handler = type(
+        "Handler", (StandinHandler,), {"media_dir": os.path.realpath(served)}
+    )
+    httpd = ThreadingHTTPServer(("localhost", 0), handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield served, f"http://localhost:{httpd.server_port}/audio/"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+# Leaves out/ as a download interrupted after `size` bytes leaves it: a
+# .part file, and the manifest entry with the ETag but not complete
+def interrupt(out, size):
+    path = out / "SVABA0464.mp3"
+    (out / "SVABA0464.mp3.part").write_bytes(path.read_bytes()[:size])
+    path.unlink()
+    manifest = json.loads((out / "manifest.json").read_text())
+    manifest["SVA BA 0464"]["complete"] = False
+    (out / "manifest.json").write_text(json.dumps(manifest))
+
+
+def test_resume_part(tmp_path, server):
+    served, base = server
+    source = served / "fritt" / "SVA BA 1969" / "SVABA0464.mp3"
+    source.parent.mkdir(parents=True)
+    source.write_bytes(os.urandom(300_000))
+    out = tmp_path / "media"
+
+    stats = MediaFetcher(str(out), rewrite=(AUDIO, base)).fetch_all([RECORD])
+    assert stats["downloaded"] == 1
+
+    interrupt(out, 100_000)
+    path = out / "SVABA0464.mp3"
+    part = out / "SVABA0464.mp3.part"
+
+    fetcher = MediaFetcher(str(out), rewrite=(AUDIO, base))
+    stats = fetcher.fetch_all([RECORD])
+    assert stats["resumed"] == 1
+    assert stats["bytes"] == 200_000
+    assert not part.exists()
+    assert path.read_bytes() == source.read_bytes()
+    entry = fetcher.manifest["SVA BA 0464"]
+    assert entry["complete"] and entry["size"] == 300_000
+    assert entry["sha256"] == file_sha256(source)
+
+    # complete files are skipped
+    stats = MediaFetcher(str(out), rewrite=(AUDIO, base)).fetch_all([RECORD])
+    assert stats["skipped"] == 1
+
+
+# A part of a file that changed since is thrown away, since If-Range
+# makes the server send the whole new file
+def test_changed_since_part(tmp_path, server):
+    served, base = server
+    source = served / "fritt" / "SVA BA 1969" / "SVABA0464.mp3"
+    source.parent.mkdir(parents=True)
+    source.write_bytes(os.urandom(300_000))
+    out = tmp_path / "media"
+    MediaFetcher(str(out), rewrite=(AUDIO, base)).fetch_all([RECORD])
+
+    interrupt(out, 100_000)
+    source.write_bytes(os.urandom(250_000))
+
+    stats = MediaFetcher(str(out), rewrite=(AUDIO, base)).fetch_all([RECORD])
+    assert stats["downloaded"] == 1
+    assert (out / "SVABA0464.mp3").read_bytes() == source.read_bytes()
@@ -0,0 +1,76 @@
+from types import SimpleNamespace
+
+import pytest
+from scrapy.exceptions import NotConfigured
+from scrapy.http import Request, Response
+from scrapy.settings import Settings
+
+from visarkiv.middlewares import AdaptiveConcurrencyMiddleware
+
+
+class Stats:
+    def __init__(self):
+        self.values = {}
+
+    def max_value(self, key, value):
+        self.values[key] = max(self.values.get(key, value), value)
+
+
+def crawler(**settings):
+    project = Settings()
+    project.setmodule("visarkiv.settings")
+    project.update(settings)
+    slot = SimpleNamespace(concurrency=project.getint("ADAPTIVE_CONCURRENCY_START"))
+    downloader = SimpleNamespace(slots={"katalog.visarkiv.se": slot})
+    return SimpleNamespace(
+        settings=project, engine=SimpleNamespace(downloader=downloader), stats=Stats()
+    )
+
+
+def respond(middleware, status=200, latency=0.1):
+    request = Request(
+        "https://katalog.visarkiv.se/lib/views/rec/ShowRecord.aspx?hit=1",
+        meta={"download_slot": "katalog.visarkiv.se", "download_latency": latency},
+    )
+    response = Response(request.url, status=status, request=request)
+    spider = SimpleNamespace(logger=SimpleNamespace(debug=lambda msg: None))
+    assert middleware.process_response(request, response, spider) is response
+
+
+def test_disabled():
+    with pytest.raises(NotConfigured):
+        AdaptiveConcurrencyMiddleware.from_crawler(crawler())
+
+
+# One more concurrent request per window of fast successes, half as many
+# on a throttled, failed or slow response, within the configured bounds
+def test_aimd():
+    c = crawler(ADAPTIVE_CONCURRENCY_ENABLED=True, ADAPTIVE_CONCURRENCY_MAX=4)
+    middleware = AdaptiveConcurrencyMiddleware.from_crawler(c)
+    slot = c.engine.downloader.slots["katalog.visarkiv.se"]
+    window = c.settings.getint("ADAPTIVE_CONCURRENCY_WINDOW")
+    assert slot.concurrency == 2
+
+    concurrency = []
+    for _ in range(window * 3):
+        respond(middleware)
+        concurrency.append(slot.concurrency)
+    assert concurrency[window - 2 : window] == [2, 3]
+    assert concurrency[2 * window - 2 : 2 * window] == [3, 4]
+    # capped at ADAPTIVE_CONCURRENCY_MAX
+    assert concurrency[-1] == 4
+    assert c.stats.values["adaptive_concurrency/max"] == 4
+
+    respond(middleware, status=503)
+    assert slot.concurrency == 2
+    respond(middleware, latency=3.0)
+    assert slot.concurrency == 1
+    respond(middleware, status=429)
+    assert slot.concurrency == 1
+
+    # a decrease starts a new window
+    for _ in range(window - 1):
+        respond(middleware)
+    assert slot.concurrency == 1
+    respond(middleware)
+    assert slot.concurrency == 2
@@ -0,0 +1,38 @@
+import datetime
+
+import numpy as np
+import pandas as pd
+
+from snapshot import load_snapshot
+
+
+# What read_excel leaves in columns of mixed types, which are stored as
+# JSON in the snapshot
+def catalog():
+    return pd.DataFrame(
+        {
+            "Titel eller låtnamn": ["Polska", "Vals", "Gånglåt", "Visa", "Brudmarsch"],
+            "Årtal": [1951, "1952-53", np.int64(1960), None, 1.5],
+            "Inspelad": [
+                datetime.datetime(1951, 6, 3, 14, 30),
+                datetime.date(1952, 7, 1),
+                pd.Timestamp("1960-01-02 03:04:05.123456789"),
+                pd.NaT,
+                "okänt",
+            ],
+            "Tid": [datetime.time(10, 30), "10.30", None, datetime.time(0, 5, 1), 3],
+        }
+    )
+
+
+# A build from the snapshot sees the same frame as one from the catalog
+def test_snapshot_round_trip(tmp_path):
+    source = tmp_path / "hitta-folkmusiken.xls"
+    source.write_bytes(b"catalog")
+    path = str(tmp_path / "hitta-folkmusiken.feather")
+
+    read = load_snapshot(str(source), path, catalog)
+    snapshot = load_snapshot(str(source), path, lambda: None)
+    pd.testing.assert_frame_equal(snapshot, read)
+    for column in ["Inspelad", "Tid"]:
+        assert list(map(type, snapshot[column])) == list(map(type, read[column]))
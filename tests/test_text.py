@@ -0,0 +1,47 @@
+import json
+import os
+import shutil
+import subprocess
+
+import pytest
+
+import text
+from conftest import ROOT
+from export import slugify
+from matching import fold
+
+NAMES = [
+    "Källby",
+    "Ångermanland",
+    "ÖSTERGÖTLAND",
+    "Lilla vallpiga dra på dig små skorna",
+    "Polska efter Lapp-Nils",
+    "Café Noël",
+    "ﬁol",
+    "Ørjan",
+    "",
+    None,
+]
+
+
+def test_fold():
+    assert text.fold("Källby") == "kallby"
+    assert fold("Polska efter Lapp-Nils") == "polska efter lapp nils"
+    assert slugify("Ångermanland") == "angermanland"
+
+
+# The browser folds queries with search.js, which has to agree with the
+# index search.py folded its terms with
+@pytest.mark.skipif(shutil.which("node") is None, reason="needs node")
+def test_fold_agrees_with_search_js(tmp_path):
+    shutil.copy(
+        os.path.join(ROOT, "vastgotalatar", "src", "search.js"), tmp_path / "search.mjs"
+    )
+    script = (
+        "import { fold } from './search.mjs';"
+        f"console.log(JSON.stringify({json.dumps(NAMES)}.map(fold)));"
+    )
+    out = subprocess.check_output(
+        ["node", "--input-type=module", "-e", script], cwd=tmp_path
+    )
+    assert json.loads(out) == [text.fold(name) for name in NAMES]
@@ -0,0 +1,12 @@
+import unicodedata
+
+
+# "Källby" -> "källby" -> "kallby": lowercase without diacritics, so that
+# names and words match whether or not they're spelled with å, ä and ö.
+# Every folding of names and titles builds on this, and fold in
+# vastgotalatar/src/search.js does the same for queries in the browser:
+#
+#   String(s || '').normalize('NFKD').replace(/\p{M}/gu, '').toLowerCase()
+def fold(s):
+    s = unicodedata.normalize("NFKD", str(s) if s else "")
+    return "".join(c for c in s if not unicodedata.category(c).startswith("M")).lower()
@@ -1,31 +1,25 @@
-import { AdvancedMarker, APIProvider, Map } from '@vis.gl/react-google-maps';
-import { useEffect, useState } from 'react';
-
-function FilterPanel({ showFilter, filters, setFilters, locations }) {
-    const primaryTypeOptions = getUniqueValuesWithCounts(
-        locations,
-        'song_type_main',
-        filters,
-        'primary_type'
-    );
-    const secondaryTypeOptions = getUniqueValuesWithCounts(
-        locations,
-        'song_type_secondary',
-        filters,
-        'secondary_type'
-    );
-    const instrumentOptions = getUniqueValuesWithCounts(
-        locations,
-        'instrument',
-        filters,
-        'instrument'
-    );
-    const collectorOptions = getUniqueValuesWithCounts(
-        locations,
-        'collector',
-        filters,
-        'collector'
-    );
+import { AdvancedMarker, APIProvider, Map, useMap } from '@vis.gl/react-google-maps';
+import { useCallback, useEffect, useMemo, useRef, useState } from 'react';
+import { FacetIndex, hasBit } from './facets';
+import { decodeHitta } from './hitta';
+import { searchRows } from './search';
+
+// Below this zoom level the map draws the clusters precomputed by
+// process.py instead of one marker per group
+const CLUSTER_MAX_ZOOM = 15;
+const MIN_ZOOM = 6;
+
+function FilterPanel({ showFilter, filters, setFilters, locations, titleMatches, facets, titleRows }) {
+    // The counts of each option within the rows that match the other
+    // filters: from the facet index once it's loaded, by going through
+    // the rows until then
+    const options = (field, filterKey) => (facets
+        ? facets.counts(filterKey, facets.matchRows(filters, filterKey, titleRows))
+        : getUniqueValuesWithCounts(locations, field, filters, filterKey, titleMatches));
+    const primaryTypeOptions = options('song_type_main', 'primary_type');
+    const secondaryTypeOptions = options('song_type_secondary', 'secondary_type');
+    const instrumentOptions = options('instrument', 'instrument');
+    const collectorOptions = options('collector', 'collector');
 
     return (
         <div className="absolute top-4 right-4 bg-white rounded-lg shadow-xl p-4 z-10 w-80">
@@ -204,6 +198,12 @@ function RecordTable({ records }) {
                                 </div>
                             </div>
                         )}
+                        {record.media_url && (
+                            <div className="mt-2">
+                                <span className="font-semibold">Inspelning (Svenskt visarkiv): </span>
+                                <audio controls preload="none" src={record.media_url} className="mt-1 w-full" />
+                            </div>
+                        )}
                     </div>
                 ))}
             </div>
@@ -252,6 +252,39 @@ function LocationModal({ location, records, onClose }) {
     );
 }
 
+function ClusterMarkers({ clusters, zoom, onGroupClick }) {
+    const map = useMap();
+
+    return clusters.map(([lat, lng, rows, groups, key, facets], idx) => (
+        <AdvancedMarker
+            key={`${zoom}-${idx}`}
+            position={{ lat, lng }}
+            title={clusterTitle(rows, facets)}
+            onClick={() => {
+                if (key) {
+                    onGroupClick(key);
+                } else if (map) {
+                    map.panTo({ lat, lng });
+                    map.setZoom(zoom + 2);
+                }
+            }}
+        >
+            {groups > 1 && (
+                <div className="flex items-center justify-center w-8 h-8 rounded-full bg-blue-600 text-white text-xs font-bold shadow-lg">
+                    {rows}
+                </div>
+            )}
+        </AdvancedMarker>
+    ));
+}
+
+function clusterTitle(rows, facets) {
+    const top = Object.values(facets)
+        .flatMap(values => values.slice(0, 1))
+        .map(([value, count]) => `${value} (${count})`);
+    return [`${rows} inspelningar`, ...top].join('\n');
+}
+
 function TuneMap() {
     const [showFilter, setShowFilter] = useState(true);
     const [showModal, setShowModal] = useState(false);
@@ -263,34 +296,176 @@ function TuneMap() {
         instrument: '',
         collector: ''
     });
+    // The index has every group's coords, row count and shard, which is
+    // enough to draw the markers. Rows are fetched per shard on demand.
+    const [index, setIndex] = useState(null);
     const [locations, setLocations] = useState({});
+    const shardRequests = useRef({});
+
+    const loadShard = useCallback((shards, shard) => {
+        if (!shardRequests.current[shard]) {
+            shardRequests.current[shard] = fetch(`/hitta/${shards[shard]}`)
+                .then(response => response.json())
+                .then(decodeHitta)
+                .then(data => {
+                    setLocations(prev => ({ ...prev, ...data }));
+                    return data;
+                });
+        }
+        return shardRequests.current[shard];
+    }, []);
 
     useEffect(() => {
-        fetch('/hitta.json')
+        fetch('/hitta/index.json')
             .then(response => response.json())
-            .then(data => setLocations(data))
-            .catch(error => console.error('Error loading hitta.json:', error));
+            .then(setIndex)
+            .catch(error => console.error('Error loading hitta/index.json:', error));
     }, []);
 
-    // Filter locations based on current filters
-    const filteredLocations = getFilteredLocations(locations, filters);
+    const shardOf = useMemo(() => {
+        const shards = {};
+        if (index) {
+            index.groups.forEach(([location, , , shard]) => {
+                shards[location] = shard;
+            });
+        }
+        return shards;
+    }, [index]);
+
+    // position of each group in the index, which is also its position
+    // in the facet index
+    const groupIds = useMemo(() => {
+        const ids = {};
+        if (index) {
+            index.groups.forEach(([location], i) => {
+                ids[location] = i;
+            });
+        }
+        return ids;
+    }, [index]);
+
+    // The filters count and match rows with the facet index, so shards
+    // are only fetched when a group is opened. Without the facet index
+    // the filters have to go through every row, so all shards are
+    // fetched instead.
+    const [facets, setFacets] = useState(null);
+    useEffect(() => {
+        if (!index) {
+            return;
+        }
+        fetch('/hitta/facets.json')
+            .then(response => response.json())
+            .then(data => setFacets(new FacetIndex(data, index.groups.map(group => group[2]))))
+            .catch(error => {
+                console.error('Error loading hitta/facets.json:', error);
+                index.shards.forEach((_, shard) => loadShard(index.shards, shard));
+            });
+    }, [index, loadShard]);
+
+    const filtersActive = Object.values(filters).some(value => value);
+
+    // The title search index is only needed once someone searches
+    const [searchIndex, setSearchIndex] = useState(null);
+    const searchRequested = useRef(false);
+    useEffect(() => {
+        if (!filters.title || searchRequested.current) {
+            return;
+        }
+        searchRequested.current = true;
+        fetch('/search.json')
+            .then(response => response.json())
+            .then(setSearchIndex)
+            .catch(error => console.error('Error loading search.json:', error));
+    }, [filters.title]);
+
+    const titleMatches = useMemo(
+        () => (searchIndex && filters.title ? searchRows(searchIndex, filters.title) : null),
+        [searchIndex, filters.title]
+    );
+
+    // The title filter isn't in the facet index, so its rows are taken
+    // from the search index, or found among the rows loaded so far
+    // until that's loaded
+    const titleRows = useMemo(() => {
+        if (!facets || !filters.title) {
+            return null;
+        }
+        const ids = [];
+        if (titleMatches) {
+            Object.entries(titleMatches).forEach(([location, rows]) => {
+                const offset = facets.offsets[groupIds[location]];
+                rows.forEach(i => ids.push(offset + i));
+            });
+        } else {
+            Object.entries(locations).forEach(([location, data]) => {
+                const offset = facets.offsets[groupIds[location]];
+                data.rows.forEach((row, i) => {
+                    if (matchesTitle(location, i, row, filters.title, null)) {
+                        ids.push(offset + i);
+                    }
+                });
+            });
+        }
+        return facets.rowSet(ids);
+    }, [facets, locations, groupIds, filters.title, titleMatches]);
+
+    const [zoom, setZoom] = useState(8);
+    const [clusters, setClusters] = useState({});
+    const zoomLevel = Math.max(MIN_ZOOM, Math.round(zoom));
 
-    // Create one pin per location from filtered locations
-    const locationPins = Object.entries(filteredLocations).flatMap(([location, data]) => {
-        if (!data.coords) {
+    useEffect(() => {
+        if (zoomLevel >= CLUSTER_MAX_ZOOM || clusters[zoomLevel]) {
+            return;
+        }
+        fetch(`/hitta/clusters/z${zoomLevel}.json`)
+            .then(response => response.json())
+            .then(data => setClusters(prev => ({ ...prev, [zoomLevel]: data })))
+            .catch(error => console.error('Error loading clusters:', error));
+    }, [zoomLevel, clusters]);
+
+    const showClusters = !filtersActive && zoomLevel < CLUSTER_MAX_ZOOM && clusters[zoomLevel];
+
+    // Filter locations based on current filters, with the facet index
+    // if it's loaded
+    let pinGroups = index ? index.groups : [];
+    let filterLocation = (location, data) => data;
+    if (filtersActive && facets) {
+        const matchesGroup = facets.groupMatcher(filters, titleRows);
+        pinGroups = pinGroups.filter((group, i) => matchesGroup(i));
+
+        const rows = facets.matchRows(filters, null, titleRows);
+        filterLocation = (location, data) => {
+            const offset = facets.offsets[groupIds[location]];
+            return { ...data, rows: data.rows.filter((row, i) => hasBit(rows, offset + i)) };
+        };
+    } else if (filtersActive) {
+        const filteredLocations = getFilteredLocations(locations, filters, titleMatches);
+        pinGroups = Object.entries(filteredLocations).map(([location, data]) => [location, data.coords]);
+        filterLocation = location => filteredLocations[location];
+    }
+
+    // Create one pin per location
+    const locationPins = pinGroups.flatMap(([location, coords]) => {
+        if (!coords) {
             return [];
         }
-        return data.coords.map((coord, index) => ({
-            id: location + index,
+        return coords.map((coord, i) => ({
+            id: location + i,
             position: { lat: coord[0], lng: coord[1] },
-            location: location,
-            data: data
+            location: location
         }));
     });
 
-    function handlePinClick(location, locationData) {
-        setSelectedLocation({ location, data: locationData });
-        setShowModal(true);
+    function handlePinClick(location) {
+        // the cluster markers can be on screen before the index is
+        // loaded, and the index tells which shard has the group
+        if (!index || shardOf[location] === undefined) {
+            return;
+        }
+        loadShard(index.shards, shardOf[location]).then(data => {
+            setSelectedLocation({ location, data: filterLocation(location, data[location]) });
+            setShowModal(true);
+        });
     }
 
     return (
@@ -306,12 +481,19 @@ function TuneMap() {
                         gestureHandling={'greedy'}
                         className="w-full h-full"
                         disableDefaultUI={true}
+                        onZoomChanged={(ev) => setZoom(ev.detail.zoom)}
                     >
-                        {locationPins.map(pin => (
+                        {showClusters ? (
+                            <ClusterMarkers
+                                clusters={clusters[zoomLevel]}
+                                zoom={zoomLevel}
+                                onGroupClick={handlePinClick}
+                            />
+                        ) : locationPins.map(pin => (
                             <AdvancedMarker
                                 key={pin.id}
                                 position={pin.position}
-                                onClick={() => handlePinClick(pin.location, pin.data)}
+                                onClick={() => handlePinClick(pin.location)}
                             />
                         ))}
                     </Map>
@@ -324,6 +506,9 @@ function TuneMap() {
                     filters={filters}
                     setFilters={setFilters}
                     locations={locations}
+                    titleMatches={titleMatches}
+                    facets={facets}
+                    titleRows={titleRows}
                 />
             )}
 
@@ -345,16 +530,16 @@ function TuneMap() {
     );
 }
 
-function getUniqueValuesWithCounts(locations, field, filters, excludeField) {
+function getUniqueValuesWithCounts(locations, field, filters, excludeField, titleMatches) {
     const counts = {};
 
-    Object.values(locations).forEach(location => {
-        location.rows.forEach(row => {
+    Object.entries(locations).forEach(([location, data]) => {
+        data.rows.forEach((row, i) => {
             // Only count rows that match the other filter
             const otherFilters = { ...filters };
             delete otherFilters[excludeField];
 
-            if (filterRows(row, otherFilters)) {
+            if (filterRows(location, i, row, otherFilters, titleMatches)) {
                 if (field === 'song_type_main') {
                     if (row.filter && row.filter.song_type && row.filter.song_type.main) {
                         counts[row.filter.song_type.main] =
@@ -387,15 +572,13 @@ function getUniqueValuesWithCounts(locations, field, filters, excludeField) {
         .map(([value, count]) => ({ value, count }));
 }
 
-function filterRows(row, filters) {
+// row is the i-th row of the group at location
+function filterRows(location, i, row, filters, titleMatches) {
     // Check if row has filter data
     if (!row.filter) return false;
 
     // Title filtering
-    const titleMatch = !filters.title || (
-        row['Titel eller låtnamn'] &&
-        row['Titel eller låtnamn'].toLowerCase().includes(filters.title.toLowerCase())
-    );
+    const titleMatch = !filters.title || matchesTitle(location, i, row, filters.title, titleMatches);
 
     // Primary type filtering
     const primaryTypeMatch = !filters.primary_type || (
@@ -424,9 +607,21 @@ function filterRows(row, filters) {
     return titleMatch && primaryTypeMatch && secondaryTypeMatch && instrumentMatch && collectorMatch;
 }
 
-function getFilteredLocations(locations, filters) {
+// With the search index once it's loaded, a row matches if the index
+// lists it under a matching title or track of its audio
+function matchesTitle(location, i, row, title, titleMatches) {
+    if (titleMatches) {
+        return Boolean(titleMatches[location] && titleMatches[location].has(i));
+    }
+    return Boolean(
+        row['Titel eller låtnamn'] &&
+        String(row['Titel eller låtnamn']).toLowerCase().includes(title.toLowerCase())
+    );
+}
+
+function getFilteredLocations(locations, filters, titleMatches) {
     return Object.entries(locations).reduce((acc, [location, data]) => {
-        const filteredRows = data.rows.filter(row => filterRows(row, filters));
+        const filteredRows = data.rows.filter((row, i) => filterRows(location, i, row, filters, titleMatches));
         if (filteredRows.length > 0) {
             acc[location] = {
                 ...data,
@@ -0,0 +1,145 @@
+// The facet index written by facets.py (public/hitta/facets.json). Row
+// and group sets are decoded into bitsets of 32-bit words on first use,
+// so that filters combine with AND and OR a word at a time and the
+// facet counts are popcounts instead of a pass over every row.
+
+function decodeSet(encoded, size) {
+    const words = new Uint32Array(Math.ceil(size / 32));
+    if (typeof encoded === 'string') {
+        const binary = atob(encoded);
+        const bytes = new Uint8Array(words.buffer);
+        for (let i = 0; i < binary.length; i++) {
+            bytes[i] = binary.charCodeAt(i);
+        }
+    } else {
+        let id = 0;
+        for (const delta of encoded) {
+            id += delta;
+            words[id >>> 5] |= 1 << (id & 31);
+        }
+    }
+    return words;
+}
+
+function and(a, b) {
+    if (!a || !b) {
+        return a || b;
+    }
+    const result = new Uint32Array(a.length);
+    for (let i = 0; i < a.length; i++) {
+        result[i] = a[i] & b[i];
+    }
+    return result;
+}
+
+function or(a, b) {
+    const result = a.slice();
+    for (let i = 0; i < b.length; i++) {
+        result[i] |= b[i];
+    }
+    return result;
+}
+
+function popcount(words) {
+    let count = 0;
+    for (let i = 0; i < words.length; i++) {
+        let w = words[i];
+        w -= (w >>> 1) & 0x55555555;
+        w = (w & 0x33333333) + ((w >>> 2) & 0x33333333);
+        count += (((w + (w >>> 4)) & 0x0f0f0f0f) * 0x01010101) >>> 24;
+    }
+    return count;
+}
+
+export function hasBit(words, i) {
+    return (words[i >>> 5] & (1 << (i & 31))) !== 0;
+}
+
+// A filter's selected values: '' for none, a value, or several (ORed)
+function selected(value) {
+    return [].concat(value || []).filter(Boolean);
+}
+
+export class FacetIndex {
+    // groupSizes: the row count of each group, in the order of
+    // hitta/index.json
+    constructor(data, groupSizes) {
+        this.data = data;
+        this.sets = {};
+        this.offsets = new Uint32Array(groupSizes.length + 1);
+        groupSizes.forEach((size, i) => {
+            this.offsets[i + 1] = this.offsets[i] + size;
+        });
+    }
+
+    set(facet, value, level) {
+        const key = `${level}\u0000${facet}\u0000${value}`;
+        if (!this.sets[key]) {
+            const entry = this.data.facets[facet][value];
+            this.sets[key] = level === 'rows'
+                ? decodeSet(entry ? entry[1] : [], this.data.rows)
+                : decodeSet(entry ? entry[2] : [], this.data.groups);
+        }
+        return this.sets[key];
+    }
+
+    // A row set from row ids, e.g. of the rows whose title matches
+    rowSet(ids) {
+        const words = new Uint32Array(Math.ceil(this.data.rows / 32));
+        ids.forEach(id => {
+            words[id >>> 5] |= 1 << (id & 31);
+        });
+        return words;
+    }
+
+    // The rows that match the filters on every facet but `except`, and
+    // that are in extraRows if it's given; null if there's nothing to
+    // match
+    matchRows(filters, except = null, extraRows = null) {
+        let result = extraRows;
+        Object.keys(this.data.facets).forEach(facet => {
+            const values = facet === except ? [] : selected(filters[facet]);
+            if (values.length) {
+                const rows = values
+                    .map(value => this.set(facet, value, 'rows'))
+                    .reduce(or);
+                result = and(result, rows);
+            }
+        });
+        return result;
+    }
+
+    // Values and row counts of a facet within rows (null for all rows),
+    // most common first
+    counts(facet, rows) {
+        return Object.entries(this.data.facets[facet])
+            .map(([value, [count]]) => ({
+                value,
+                count: rows ? popcount(and(rows, this.set(facet, value, 'rows'))) : count
+            }))
+            .filter(({ count }) => count > 0)
+            .sort((a, b) => b.count - a.count);
+    }
+
+    groupHasRow(rows, group) {
+        for (let i = this.offsets[group]; i < this.offsets[group + 1]; i++) {
+            if (hasBit(rows, i)) {
+                return true;
+            }
+        }
+        return false;
+    }
+
+    // A function telling whether group i (in the order of
+    // hitta/index.json) has a row that matches. A filter on a single
+    // facet value is answered from that value's group set.
+    groupMatcher(filters, extraRows = null) {
+        const active = Object.keys(this.data.facets).filter(f => selected(filters[f]).length);
+        if (!extraRows && active.length === 1 && selected(filters[active[0]]).length === 1) {
+            const groups = this.set(active[0], selected(filters[active[0]])[0], 'groups');
+            return group => hasBit(groups, group);
+        }
+        const rows = this.matchRows(filters, null, extraRows);
+        return rows ? group => this.groupHasRow(rows, group) : () => true;
+    }
+}
@@ -0,0 +1,43 @@
+// Decodes the compact form of the hitta data written by export.py
+// (process.py build --compact). Other data is returned as it is, so the
+// map reads either form. Values that were null are left out of the rows,
+// and rows get their group's coords.
+
+// columns per word of a row's presence mask
+const MASK_BITS = 32;
+
+export function decodeHitta(data) {
+    if (data.format !== 'compact-1') {
+        return data;
+    }
+
+    const { columns, values } = data;
+    const words = Math.max(1, Math.ceil(columns.length / MASK_BITS));
+    const groups = {};
+    Object.entries(data.groups).forEach(([key, group]) => {
+        groups[key] = {
+            ...group,
+            rows: group.rows.map(encoded => {
+                const row = { coords: group.coords };
+                let j = words;
+                for (let i = 0; i < columns.length; i++) {
+                    if (!(encoded[Math.floor(i / MASK_BITS)] & (1 << (i % MASK_BITS)))) {
+                        continue;
+                    }
+                    const value = values[i] ? values[i][encoded[j]] : encoded[j];
+                    j++;
+                    // a key of a column that was split, e.g. ["filter", "collector"]
+                    const column = columns[i];
+                    if (Array.isArray(column)) {
+                        row[column[0]] = row[column[0]] || {};
+                        row[column[0]][column[1]] = value;
+                    } else {
+                        row[column] = value;
+                    }
+                }
+                return row;
+            })
+        };
+    });
+    return groups;
+}
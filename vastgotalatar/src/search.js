@@ -0,0 +1,70 @@
+// Queries the search index written by search.py (public/search.json).
+// Terms are folded as by fold in text.py: lowercase, no diacritics.
+
+export function fold(s) {
+    return String(s || '').normalize('NFKD').replace(/\p{M}/gu, '').toLowerCase();
+}
+
+export function tokenize(s) {
+    return fold(s).match(/[a-z0-9]+/g) || [];
+}
+
+// first term that isn't less than term
+function lowerBound(terms, term) {
+    let lo = 0;
+    let hi = terms.length;
+    while (lo < hi) {
+        const mid = (lo + hi) >> 1;
+        if (terms[mid] < term) {
+            lo = mid + 1;
+        } else {
+            hi = mid;
+        }
+    }
+    return lo;
+}
+
+// Ids of the documents that have a term starting with every word of the
+// query
+export function searchIds(index, query) {
+    let result = null;
+    for (const word of tokenize(query)) {
+        const lo = lowerBound(index.terms, word);
+        const hi = lowerBound(index.terms, word + '\uffff');
+        const ids = new Set();
+        for (let i = lo; i < hi; i++) {
+            let id = 0;
+            for (const delta of index.postings[i]) {
+                id += delta;
+                ids.add(id);
+            }
+        }
+        result = result === null ? ids : new Set([...result].filter(id => ids.has(id)));
+        if (result.size === 0) {
+            break;
+        }
+    }
+    return result || new Set();
+}
+
+// The rows where the titles and tracks that match a query are found, as
+// sets of row indices per group key. A document's last item has its
+// row ids, which count the rows of the groups in order.
+export function searchRows(index, query) {
+    const offsets = [0];
+    index.groups.forEach(([, rows]) => offsets.push(offsets[offsets.length - 1] + rows));
+
+    const matches = {};
+    searchIds(index, query).forEach(id => {
+        const doc = index.docs[id];
+        let row = 0;
+        for (const delta of doc[doc.length - 1]) {
+            row += delta;
+            // the last group that starts at or before the row
+            const group = lowerBound(offsets, row + 1) - 1;
+            const key = index.groups[group][0];
+            (matches[key] = matches[key] || new Set()).add(row - offsets[group]);
+        }
+    });
+    return matches;
+}
@@ -0,0 +1,221 @@
+# Local stand-in for katalog.visarkiv.se that serves the saved pages, for
+# running the spider without touching the real archive:
+#
+#   python standin_server.py --port 8000 --hits 94 --latency 0.2 --error-rate 0.05
+#   scrapy crawl visarkiv -a base_url=http://localhost:8000 \
+#       -s ADAPTIVE_CONCURRENCY_ENABLED=1
+#
+# AdvancedSearch.aspx serves search-page.html with a fresh session
+# cookie, and ShowRecord.aspx?hit=N serves item-page.html as the record
+# "SVA BA N" of the hit list. HitList.aspx serves
+# results-page.html with its rows repeated to fill pages of the
+# requested size, numbered "SVA BA 0001" up to --hits, and the "next"
+# link disabled on the last page.
+#
+# With --media-dir, /audio/<path> serves the files in that directory
+# with ETag and Range support, for media.py:
+#
+#   AUDIO=https://katalog.visarkiv.se/lib/views/rec/XrefThemes/Theme1/src/audio
+#   python -m visarkiv.media --rewrite "$AUDIO/=http://localhost:8000/audio/"
+
+import argparse
+import os
+import random
+import re
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+NEXT_LINK = 'id="ctl00_cphContent_lblNextBottom"'
+HIT_ROW = re.compile(r'<tr class="(?:row|alternaterow)">.*?</tr>', re.DOTALL)
+
+
+def read_fixture(name):
+    with open(os.path.join(HERE, name), encoding="utf-8") as f:
+        return f.read()
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    hits = 94
+    latency = 0.0
+    error_rate = 0.0
+    media_dir = None
+
+    fixtures = {
+        "search": read_fixture("search-page.html"),
+        "results": read_fixture("results-page.html"),
+        "item": read_fixture("item-page.html"),
+    }
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path.endswith("/AdvancedSearch.aspx"):
+            self.respond(
+                self.fixtures["search"],
+                cookies=[
+                    f"ASP.NET_SessionId={uuid.uuid4().hex}; path=/; HttpOnly",
+                    f".ASPXANONYMOUS={uuid.uuid4().hex}; path=/; HttpOnly",
+                ],
+            )
+        elif path.endswith("/ShowRecord.aspx"):
+            hit = parse_qs(urlparse(self.path).query).get("hit", [""])[0]
+            self.respond(self.record_page(hit.split("_")[0]))
+        elif path.startswith("/audio/") and self.media_dir:
+            self.send_media(unquote(path[len("/audio/") :]))
+        else:
+            self.send_error(404)
+
+    def do_POST(self):
+        path = urlparse(self.path).path
+        if not path.endswith("/HitList.aspx"):
+            self.send_error(404)
+            return
+
+        length = int(self.headers.get("Content-Length", 0))
+        form = parse_qs(self.rfile.read(length).decode("utf-8"))
+        page_size = int(form.get("ctl00$cphContent$ddDisplayHits", ["20"])[0])
+        pages = max(1, -(-self.hits // page_size))
+        if "ctl00$cphContent$btnGo" in form:
+            page = int(form["ctl00$cphContent$txtGo"][0])
+        elif form.get("__EVENTTARGET") == ["ctl00$cphContent$lblNextBottom"]:
+            page = int(form["ctl00$cphContent$txtGo"][0]) + 1
+        else:
+            page = 1
+        page = min(max(page, 1), pages)
+        self.respond(self.results_page(page, page_size, pages))
+
+    def results_page(self, page, page_size, pages):
+        html = self.fixtures["results"]
+        templates = HIT_ROW.findall(html)
+        first = (page - 1) * page_size + 1
+        last = min(page * page_size, self.hits)
+
+        rows = []
+        for hit in range(first, last + 1):
+            row = templates[(hit - 1) % len(templates)]
+            row = re.sub(r"hit=\d+", f"hit={hit}", row)
+            row = re.sub(r'(class="hitnumber"[^>]*>)\d+<', rf"\g<1>{hit}<", row)
+            row = re.sub(r">SVA BA \d+<", f">SVA BA {hit:04d}<", row)
+            row_class = "alternaterow" if hit % 2 == 0 else "row"
+            row = re.sub(r'<tr class="\w+">', f'<tr class="{row_class}">', row)
+            rows.append(row)
+
+        start = html.index(templates[0])
+        end = html.index(templates[-1]) + len(templates[-1])
+        html = html[:start] + "".join(rows) + html[end:]
+
+        html = re.sub(
+            r"Visar \d+ - \d+ av \d+", f"Visar {first} - {last} av {self.hits}", html
+        )
+        html = re.sub(
+            r'(id="ctl00_cphContent_lblTotalPages">)\d+', rf"\g<1>{pages}", html
+        )
+        # the page size dropdown is the only one with numeric values
+        html = re.sub(
+            r'<option selected="selected" value="(\d+)">', r'<option value="\1">', html
+        )
+        html = html.replace(
+            f'<option value="{page_size}">',
+            f'<option selected="selected" value="{page_size}">',
+        )
+        if page >= pages:
+            html = html.replace(NEXT_LINK, NEXT_LINK + ' disabled="disabled"')
+        return html
+
+    def record_page(self, hit):
+        html = self.fixtures["item"]
+        if not hit.isdigit():
+            return html
+        number = f"{int(hit):04d}"
+        html = html.replace("SVA BA 0464", f"SVA BA {number}")
+        return html.replace("SVABA0464", f"SVABA{number}")
+
+    def send_media(self, name):
+        path = os.path.realpath(os.path.join(self.media_dir, name))
+        if not path.startswith(self.media_dir + os.sep) or not os.path.isfile(path):
+            self.send_error(404)
+            return
+        if self.fail():
+            return
+
+        stat = os.stat(path)
+        size = stat.st_size
+        etag = f'"{size:x}-{stat.st_mtime_ns:x}"'
+        start, end = 0, size - 1
+
+        match = re.match(r"bytes=(\d+)-(\d*)$", self.headers.get("Range", ""))
+        if_range = self.headers.get("If-Range")
+        partial = match is not None and if_range in (None, etag)
+        if partial:
+            start = int(match.group(1))
+            end = min(int(match.group(2) or size - 1), size - 1)
+            if start >= size:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{size}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+
+        self.send_response(206 if partial else 200)
+        self.send_header("Content-Type", "audio/mpeg")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", etag)
+        if partial:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        self.end_headers()
+        with open(path, "rb") as f:
+            f.seek(start)
+            self.wfile.write(f.read(end - start + 1))
+
+    def fail(self):
+        if self.latency:
+            time.sleep(random.expovariate(1 / self.latency))
+        if random.random() < self.error_rate:
+            self.send_error(random.choice([429, 503]))
+            return True
+        return False
+
+    def respond(self, body, cookies=()):
+        if self.fail():
+            return
+
+        data = body.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        for cookie in cookies:
+            self.send_header("Set-Cookie", cookie)
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--hits", type=int, default=94, help="hits per landskap")
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="mean response delay in seconds"
+    )
+    parser.add_argument(
+        "--error-rate", type=float, default=0.0, help="fraction of 429/503 responses"
+    )
+    parser.add_argument("--media-dir", help="directory served under /audio/")
+    args = parser.parse_args()
+
+    StandinHandler.hits = args.hits
+    StandinHandler.latency = args.latency
+    StandinHandler.error_rate = args.error_rate
+    if args.media_dir:
+        StandinHandler.media_dir = os.path.realpath(args.media_dir)
+
+    server = ThreadingHTTPServer(("localhost", args.port), StandinHandler)
+    print(f"Serving visarkiv fixtures on http://localhost:{args.port}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
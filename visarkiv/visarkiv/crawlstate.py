@@ -0,0 +1,46 @@
+import json
+import os
+
+
+# Persistent state of the crawl, so that an interrupted crawl can go on
+# from where it stopped and a re-crawl only fetches what's new:
+#
+#   {"landscapes": {"dalsland": {"page": 3, "total": 94, "done": false,
+#                                "page_size": 100}},
+#    "seen": {"SVA BA 0464": "https://.../ShowRecord.aspx?hit=1", ...}}
+#
+# Record URLs point into the hit list of a session (hit=N), so they're
+# only kept for reference and records are recognized by their
+# accessionsnummer.
+class CrawlState:
+    def __init__(self, path):
+        self.path = path
+        try:
+            with open(path) as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            state = {}
+        self.landscapes = state.get("landscapes", {})
+        self.seen = state.get("seen", {})
+
+    def landscape(self, name):
+        return self.landscapes.setdefault(
+            name, {"page": 1, "total": None, "done": False, "page_size": None}
+        )
+
+    def is_seen(self, accessionsnummer):
+        return accessionsnummer in self.seen
+
+    def mark_seen(self, accessionsnummer, url):
+        self.seen[accessionsnummer] = url
+
+    def save(self):
+        # write and rename, so an interrupted save leaves the old state
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(
+                {"landscapes": self.landscapes, "seen": self.seen},
+                f,
+                ensure_ascii=False,
+            )
+        os.replace(tmp, self.path)
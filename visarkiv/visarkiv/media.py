@@ -0,0 +1,268 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import unquote, urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    from mutagen.mp3 import MP3
+except ImportError:
+    MP3 = None
+
+from visarkiv.store import RecordStore
+
+CHUNK_SIZE = 1 << 16
+
+# how far the real duration may be from the scraped one, in minutes
+DURATION_TOLERANCE = 1.0
+
+
+# Downloads the audio of scraped records into a directory, with a
+# manifest.json of what's there:
+#
+#   {"SVA BA 0464": {"url": "...", "file": "SVABA0464.mp3", "size": 5242880,
+#                    "etag": "\"5f3a-...\"", "last_modified": "...",
+#                    "sha256": "...", "complete": true,
+#                    "duration": 1543.2, "bitrate": 128000,
+#                    "scraped_duration": "ca 26 min.", "duration_mismatch": false}}
+#
+# Complete files are skipped, and partial files (.part) are resumed with
+# a Range request. If the server answers with the whole file instead,
+# e.g. because the ETag changed, the download starts over. Duration and
+# bitrate are read with mutagen, if it's installed.
+class MediaFetcher:
+    def __init__(self, out_dir, workers=4, rewrite=None, verify=False, timeout=60):
+        self.out_dir = out_dir
+        self.workers = workers
+        self.rewrite = rewrite
+        self.verify = verify
+        self.timeout = timeout
+        self.manifest_path = os.path.join(out_dir, "manifest.json")
+        os.makedirs(out_dir, exist_ok=True)
+        try:
+            with open(self.manifest_path) as f:
+                self.manifest = json.load(f)
+        except FileNotFoundError:
+            self.manifest = {}
+        self.lock = threading.Lock()
+
+        # one pooled connection per worker, retrying on throttling and
+        # server errors
+        self.session = requests.Session()
+        retry = Retry(
+            total=3, backoff_factor=1, status_forcelist=[429, 500, 502, 503, 504]
+        )
+        adapter = HTTPAdapter(pool_maxsize=workers, max_retries=retry)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def source_url(self, url):
+        # e.g. ("https://katalog.visarkiv.se/", "http://localhost:8000/")
+        if self.rewrite and url.startswith(self.rewrite[0]):
+            return self.rewrite[1] + url[len(self.rewrite[0]) :]
+        return url
+
+    def fetch_all(self, records):
+        stats = {"downloaded": 0, "resumed": 0, "skipped": 0, "failed": 0, "bytes": 0}
+        records = [r for r in records if r.get("media_url")]
+        try:
+            with ThreadPoolExecutor(self.workers) as pool:
+                futures = {
+                    pool.submit(
+                        self.fetch, r, self.manifest.get(r["accessionsnummer"])
+                    ): r
+                    for r in records
+                }
+                for i, future in enumerate(as_completed(futures), 1):
+                    record = futures[future]
+                    try:
+                        entry, status, received = future.result()
+                    except (requests.RequestException, OSError) as e:
+                        print(f"failed {record['accessionsnummer']}: {e}")
+                        stats["failed"] += 1
+                        continue
+                    self.update_manifest(record["accessionsnummer"], entry)
+                    stats[status] += 1
+                    stats["bytes"] += received
+                    if i % 50 == 0:
+                        self.save_manifest()
+        finally:
+            self.save_manifest()
+        return stats
+
+    def fetch(self, record, entry):
+        url = record["media_url"]
+        path = os.path.join(self.out_dir, file_name(url))
+        part = path + ".part"
+
+        if entry and entry["complete"] and entry["url"] == url and self.is_complete(
+            path, entry
+        ):
+            return entry, "skipped", 0
+
+        offset = os.path.getsize(part) if os.path.exists(part) else 0
+        validator = entry and (entry.get("etag") or entry.get("last_modified"))
+        headers = {}
+        if offset and validator:
+            headers["Range"] = f"bytes={offset}-"
+            # the server sends the whole file if it changed since
+            headers["If-Range"] = validator
+
+        with self.session.get(
+            self.source_url(url), headers=headers, stream=True, timeout=self.timeout
+        ) as response:
+            if response.status_code == 416 or (
+                response.status_code == 206
+                and content_range_start(response) != offset
+            ):
+                # the part is already the whole file, or isn't valid anymore
+                os.remove(part)
+                return self.fetch(record, None)
+            response.raise_for_status()
+
+            resumed = response.status_code == 206
+            sha256 = hashlib.sha256()
+            if resumed:
+                with open(part, "rb") as f:
+                    for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                        sha256.update(chunk)
+            else:
+                offset = 0
+
+            # record the ETag before any data, so that an interrupted
+            # download can be resumed
+            entry = {
+                "url": url,
+                "file": os.path.basename(path),
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+                "complete": False,
+            }
+            self.update_manifest(record["accessionsnummer"], entry)
+
+            received = 0
+            with open(part, "ab" if resumed else "wb") as f:
+                for chunk in response.iter_content(CHUNK_SIZE):
+                    f.write(chunk)
+                    sha256.update(chunk)
+                    received += len(chunk)
+
+        os.replace(part, path)
+        entry = {
+            **entry,
+            "size": offset + received,
+            "sha256": sha256.hexdigest(),
+            "complete": True,
+            **audio_info(path, record.get("duration")),
+        }
+        return entry, "resumed" if resumed else "downloaded", received
+
+    def is_complete(self, path, entry):
+        if not os.path.exists(path) or os.path.getsize(path) != entry["size"]:
+            return False
+        return not self.verify or file_sha256(path) == entry["sha256"]
+
+    def update_manifest(self, accessionsnummer, entry):
+        with self.lock:
+            self.manifest[accessionsnummer] = entry
+
+    def save_manifest(self):
+        tmp = self.manifest_path + ".tmp"
+        with self.lock, open(tmp, "w") as f:
+            json.dump(self.manifest, f, ensure_ascii=False, indent=1)
+        os.replace(tmp, self.manifest_path)
+
+
+def file_name(url):
+    return unquote(os.path.basename(urlparse(url).path))
+
+
+def content_range_start(response):
+    # "bytes 1000-5241879/5242880"
+    match = re.match(r"bytes (\d+)-", response.headers.get("Content-Range", ""))
+    return int(match.group(1)) if match else None
+
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def scraped_minutes(duration):
+    # "ca 26 min.", often without a number ("ca  min.")
+    match = re.search(r"(\d+(?:[.,]\d+)?)\s*min", duration or "")
+    return float(match.group(1).replace(",", ".")) if match else None
+
+
+def audio_info(path, scraped_duration):
+    info = {"scraped_duration": scraped_duration}
+    if MP3 is None:
+        return info
+
+    try:
+        audio = MP3(path).info
+    except Exception as e:  # mutagen raises a variety of errors on bad files
+        print(f"unreadable audio {path}: {e}")
+        return info
+
+    info.update(duration=round(audio.length, 1), bitrate=audio.bitrate)
+    minutes = scraped_minutes(scraped_duration)
+    if minutes is not None:
+        info["duration_mismatch"] = (
+            abs(audio.length / 60 - minutes) > DURATION_TOLERANCE
+        )
+    return info
+
+
+def load_records(db=None, jsonl=None):
+    if jsonl:
+        with open(jsonl) as f:
+            return [json.loads(line) for line in f]
+    return RecordStore(db).find()
+
+
+# python -m visarkiv.media --db records.db --out media --workers 4
+#
+# and against a local server, e.g. standin_server.py --media-dir:
+#
+#   python -m visarkiv.media --rewrite \
+#       https://katalog.visarkiv.se/=http://localhost:8000/
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db", default="records.db")
+    parser.add_argument("--jsonl", help="read records from a JSONL feed instead")
+    parser.add_argument("--out", default="media")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--rewrite", metavar="FROM=TO", help="URL prefix to replace")
+    parser.add_argument(
+        "--verify", action="store_true", help="check the checksums of complete files"
+    )
+    args = parser.parse_args()
+
+    fetcher = MediaFetcher(
+        args.out,
+        workers=args.workers,
+        rewrite=args.rewrite.split("=", 1) if args.rewrite else None,
+        verify=args.verify,
+    )
+    stats = fetcher.fetch_all(load_records(args.db, args.jsonl))
+    mismatches = [
+        acc for acc, entry in fetcher.manifest.items() if entry.get("duration_mismatch")
+    ]
+    print(json.dumps(stats))
+    if mismatches:
+        print(f"duration differs from the catalog: {', '.join(sorted(mismatches))}")
+
+
+if __name__ == "__main__":
+    main()
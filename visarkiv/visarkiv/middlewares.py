@@ -3,7 +3,10 @@
 # See documentation in:
 # https://docs.scrapy.org/en/latest/topics/spider-middleware.html
 
+from collections import defaultdict
+
 from scrapy import signals
+from scrapy.exceptions import NotConfigured
 
 # useful for handling different item types with a single interface
 from itemadapter import is_item, ItemAdapter
@@ -101,3 +104,59 @@ class VisarkivDownloaderMiddleware:
 
     def spider_opened(self, spider):
         spider.logger.info("Spider opened: %s" % spider.name)
+
+
+class AdaptiveConcurrencyMiddleware:
+    # Additive increase, multiplicative decrease on the concurrency of
+    # each downloader slot: after every ADAPTIVE_CONCURRENCY_WINDOW fast
+    # and successful responses the slot gets one more concurrent
+    # request, and on a 429, a 5xx or a response slower than
+    # ADAPTIVE_CONCURRENCY_TARGET_LATENCY it's halved. Place it closer
+    # to the downloader than RetryMiddleware so that it sees the
+    # responses that get retried.
+
+    def __init__(self, crawler):
+        settings = crawler.settings
+        self.crawler = crawler
+        self.min_concurrency = settings.getint("ADAPTIVE_CONCURRENCY_MIN")
+        self.max_concurrency = settings.getint("ADAPTIVE_CONCURRENCY_MAX")
+        self.target_latency = settings.getfloat("ADAPTIVE_CONCURRENCY_TARGET_LATENCY")
+        self.window = settings.getint("ADAPTIVE_CONCURRENCY_WINDOW")
+        self.successes = defaultdict(int)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool("ADAPTIVE_CONCURRENCY_ENABLED"):
+            raise NotConfigured
+        return cls(crawler)
+
+    def process_response(self, request, response, spider):
+        key = request.meta.get("download_slot")
+        slot = self.crawler.engine.downloader.slots.get(key)
+        if slot is None:
+            return response
+
+        latency = request.meta.get("download_latency", 0)
+        if (
+            response.status == 429
+            or response.status >= 500
+            or latency > self.target_latency
+        ):
+            concurrency = max(self.min_concurrency, slot.concurrency // 2)
+            self.successes[key] = 0
+        else:
+            concurrency = slot.concurrency
+            self.successes[key] += 1
+            if self.successes[key] >= self.window:
+                concurrency = min(self.max_concurrency, concurrency + 1)
+                self.successes[key] = 0
+
+        if concurrency != slot.concurrency:
+            spider.logger.debug(
+                f"Concurrency for {key}: {slot.concurrency} -> {concurrency} "
+                f"(status {response.status}, latency {latency:.2f}s)"
+            )
+            slot.concurrency = concurrency
+            self.crawler.stats.max_value("adaptive_concurrency/max", concurrency)
+
+        return response
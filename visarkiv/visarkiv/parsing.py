@@ -0,0 +1,93 @@
+from lxml import etree
+
+# item field -> id of its row in the record table of ShowRecord.aspx
+RECORD_FIELDS = {
+    "accessionsnummer": "XRACC",
+    "namn": "XRNAMN",
+    "instrument": "XRINS",
+    "ort": "XRORT",
+    "landskap": "XRLSK",
+    "spelplats": "XRSPL",
+    "datum": "XRDATUM",
+    "innehall": "XRIHL",
+    "dokumentor": "XRDOK",
+    "duration": "XRDUR",
+    "inspelningsformat": "XRIFO",
+}
+
+# All field texts and the media link of the record table in one query,
+# in document order. Like the "td.fieldContents div::text" selectors
+# this matches only the direct text of the divs, so e.g. a landskap
+# wrapped in <span class="searched"> comes out empty.
+RECORD_XPATH = etree.XPath(
+    "//tr[starts-with(@id, 'XR')]"
+    "//td[contains(concat(' ', normalize-space(@class), ' '), ' fieldContents ')]"
+    "//div/text()"
+    " | //tr[@id='XRMED']//audio/@src"
+)
+
+
+def record_row_id(node):
+    # text nodes are attached to their element, or for tail text to the
+    # element before them
+    for el in node.getparent().iterancestors("tr"):
+        row_id = el.get("id", "")
+        if row_id.startswith("XR"):
+            return row_id
+
+
+# Parses the record table of a ShowRecord.aspx page (an lxml root, e.g.
+# response.selector.root) into the item fields and the media URL.
+def parse_record_table(root):
+    texts = {}
+    media_url = None
+    for node in RECORD_XPATH(root):
+        if node.is_attribute:
+            if media_url is None:
+                media_url = str(node)
+            continue
+        row_id = record_row_id(node)
+        texts.setdefault(row_id, []).append(node)
+
+    fields = {
+        name: "".join(texts.get(row_id, ())).strip()
+        for name, row_id in RECORD_FIELDS.items()
+    }
+    return fields, media_url
+
+
+# item field -> column of the hit list on HitList.aspx. The hit list
+# also has the performers ("Exekutörer") and whether there's sound, but
+# neither is an item field.
+HIT_LIST_FIELDS = {
+    "accessionsnummer": 1,
+    "namn": 2,
+    "instrument": 4,
+}
+
+HIT_ROWS_XPATH = etree.XPath("//tr[@class='row' or @class='alternaterow']")
+
+
+def cell_text(cell):
+    # empty cells show "[info saknas]"
+    if cell.find("span[@class='nodata']") is not None:
+        return ""
+    return "".join(cell.itertext()).strip()
+
+
+# Parses the rows of a HitList.aspx page (an lxml root) into the link to
+# each record and the item fields shown in the hit list.
+def parse_hit_list(root):
+    hits = []
+    for row in HIT_ROWS_XPATH(root):
+        cells = row.findall("td")
+        link = cells[0].find("a")
+        if link is None:
+            continue
+        fields = {
+            name: cell_text(cells[i])
+            for name, i in HIT_LIST_FIELDS.items()
+            if i < len(cells)
+        }
+        hits.append((link.get("href"), fields))
+    return hits
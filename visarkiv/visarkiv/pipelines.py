@@ -3,11 +3,89 @@
 # Don't forget to add your pipeline to the ITEM_PIPELINES setting
 # See: https://docs.scrapy.org/en/latest/topics/item-pipeline.html
 
+import re
+import time
 
 # useful for handling different item types with a single interface
 from itemadapter import ItemAdapter
+from scrapy.exceptions import DropItem
 
+from visarkiv.store import FIELDS, RecordStore
 
+
+def normalize(value):
+    if not isinstance(value, str):
+        return value
+    # collapse whitespace, and drop the separators left over when a part
+    # of a list is empty, e.g. "; Dalarna"
+    value = re.sub(r"\s+", " ", value).strip().strip(";").strip()
+    return value or None
+
+
+# Normalizes the items, drops records that were stored before with all
+# of their fields and writes the rest to ITEM_STORE_PATH, in one transaction per
+# ITEM_STORE_BATCH_SIZE items or ITEM_STORE_FLUSH_INTERVAL seconds,
+# whichever comes first. The spider's crawl state is saved after each
+# batch is written, so that records are never marked seen in a saved
+# state while they're still waiting here: a killed crawl would skip them
+# when it's resumed.
 class VisarkivPipeline:
+    def __init__(self, path, batch_size, flush_interval):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        return cls(
+            settings.get("ITEM_STORE_PATH"),
+            settings.getint("ITEM_STORE_BATCH_SIZE"),
+            settings.getfloat("ITEM_STORE_FLUSH_INTERVAL"),
+        )
+
+    def open_spider(self, spider):
+        self.store = RecordStore(self.path)
+        # the fields stored per accessionsnummer
+        self.seen = self.store.filled()
+        self.batch = []
+        self.flushed = time.monotonic()
+
+    def close_spider(self, spider):
+        self.flush(spider)
+        self.store.close()
+
     def process_item(self, item, spider):
+        adapter = ItemAdapter(item)
+        for name, value in adapter.items():
+            adapter[name] = normalize(value)
+
+        accessionsnummer = adapter.get("accessionsnummer")
+        if not accessionsnummer:
+            raise DropItem(f"Missing accessionsnummer in {adapter.get('url')}")
+        fields = {
+            name
+            for name, value in adapter.items()
+            if name in FIELDS and value is not None
+        }
+        stored = self.seen.setdefault(accessionsnummer, set())
+        if fields <= stored:
+            raise DropItem(f"Duplicate record {accessionsnummer}")
+        stored |= fields
+
+        self.batch.append(adapter.asdict())
+        if (
+            len(self.batch) >= self.batch_size
+            or time.monotonic() - self.flushed >= self.flush_interval
+        ):
+            self.flush(spider)
         return item
+
+    def flush(self, spider):
+        if self.batch:
+            self.store.put_many(self.batch)
+            self.batch = []
+            state = getattr(spider, "state", None)
+            if state is not None:
+                state.save()
+        self.flushed = time.monotonic()
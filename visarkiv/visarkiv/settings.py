@@ -53,8 +53,27 @@ DEFAULT_REQUEST_HEADERS = {
 # See https://docs.scrapy.org/en/latest/topics/downloader-middleware.html
 DOWNLOADER_MIDDLEWARES = {
     'scrapy.downloadermiddlewares.cookies.CookiesMiddleware': 700,
+    'visarkiv.middlewares.AdaptiveConcurrencyMiddleware': 600,
 }
 
+# Adaptive concurrency (off by default). Enable with
+#   scrapy crawl visarkiv -s ADAPTIVE_CONCURRENCY_ENABLED=1
+# and the spider starts at ADAPTIVE_CONCURRENCY_START concurrent requests
+# and adjusts between MIN and MAX based on latency and 429/5xx responses.
+ADAPTIVE_CONCURRENCY_ENABLED = False
+ADAPTIVE_CONCURRENCY_START = 2
+ADAPTIVE_CONCURRENCY_MIN = 1
+ADAPTIVE_CONCURRENCY_MAX = 16
+ADAPTIVE_CONCURRENCY_TARGET_LATENCY = 2.0
+ADAPTIVE_CONCURRENCY_WINDOW = 10
+
+# Crawl state: the page reached per landskap and the records already
+# harvested. An interrupted crawl continues from where it stopped, and a
+# re-crawl only fetches new records (append them with -o output.jsonl)
+# and skips landskap whose hit count is unchanged. Delete the file for a
+# full crawl.
+CRAWL_STATE_PATH = "crawlstate.json"
+
 # Enable or disable extensions
 # See https://docs.scrapy.org/en/latest/topics/extensions.html
 #EXTENSIONS = {
@@ -63,9 +82,16 @@ DOWNLOADER_MIDDLEWARES = {
 
 # Configure item pipelines
 # See https://docs.scrapy.org/en/latest/topics/item-pipeline.html
-#ITEM_PIPELINES = {
-#    "visarkiv.pipelines.VisarkivPipeline": 300,
-#}
+ITEM_PIPELINES = {
+    "visarkiv.pipelines.VisarkivPipeline": 300,
+}
+
+# Record store of VisarkivPipeline, queried with visarkiv.store.RecordStore
+# or python -m visarkiv.store. Items are written in batches of
+# ITEM_STORE_BATCH_SIZE, or every ITEM_STORE_FLUSH_INTERVAL seconds.
+ITEM_STORE_PATH = "records.db"
+ITEM_STORE_BATCH_SIZE = 500
+ITEM_STORE_FLUSH_INTERVAL = 10.0
 
 # Enable and configure the AutoThrottle extension (disabled by default)
 # See https://docs.scrapy.org/en/latest/topics/autothrottle.html
@@ -1,12 +1,22 @@
+import os
 import scrapy
-from urllib.parse import urljoin
+from urllib.parse import urljoin, urlparse
 import re
+from collections import Counter, defaultdict
+from twisted.internet.error import ConnectionRefusedError, DNSLookupError, TimeoutError
+
+from visarkiv.crawlstate import CrawlState
+from visarkiv.parsing import (
+    HIT_LIST_FIELDS,
+    RECORD_FIELDS,
+    parse_hit_list,
+    parse_record_table,
+)
 
 
 class VisarkivSpider(scrapy.Spider):
     name = "visarkiv"
-    allowed_domains = ["katalog.visarkiv.se"]
-    start_urls = ["https://katalog.visarkiv.se/lib/views/rec/AdvancedSearch.aspx"]
+    base_url = "https://katalog.visarkiv.se"
 
     landscapes = [
         # 'blekinge',
@@ -54,14 +64,76 @@ class VisarkivSpider(scrapy.Spider):
         "sec-ch-ua-platform": '"macOS"',
     }
 
-    def start_requests(self):
-        # First request to get session cookie
-        yield scrapy.Request(
-            self.start_urls[0],
-            headers=self.headers,
-            callback=self.handle_initial_cookies,
-            dont_filter=True,
+    def __init__(self, base_url=None, fields=None, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # e.g. -a base_url=http://localhost:8000 for standin_server.py
+        if base_url:
+            self.base_url = base_url.rstrip("/")
+
+        # Harvest mode, e.g. -a fields=namn,instrument: items only get
+        # these fields, and if the hit list has all of them the record
+        # pages aren't fetched at all
+        self.fields = fields.split(",") if fields else None
+        if self.fields:
+            unknown = set(self.fields) - set(RECORD_FIELDS) - {"media_url"}
+            if unknown:
+                raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+        self.from_hit_list = self.fields is not None and set(self.fields) <= set(
+            HIT_LIST_FIELDS
         )
+        self.allowed_domains = [urlparse(self.base_url).hostname]
+        self.start_urls = [f"{self.base_url}/lib/views/rec/AdvancedSearch.aspx"]
+        self.headers = {**self.headers, "Origin": self.base_url}
+
+    @classmethod
+    def update_settings(cls, settings):
+        super().update_settings(settings)
+        # Adaptive mode lifts the one-request-at-a-time limit and lets
+        # AdaptiveConcurrencyMiddleware grow and shrink the concurrency
+        # between these bounds
+        if settings.getbool("ADAPTIVE_CONCURRENCY_ENABLED"):
+            settings.set(
+                "CONCURRENT_REQUESTS",
+                settings.getint("ADAPTIVE_CONCURRENCY_MAX"),
+                priority="spider",
+            )
+            settings.set(
+                "CONCURRENT_REQUESTS_PER_DOMAIN",
+                settings.getint("ADAPTIVE_CONCURRENCY_START"),
+                priority="spider",
+            )
+
+    def start_requests(self):
+        self.state = CrawlState(self.state_path())
+        # landskap whose last hit list page was reached in this run
+        self.finished = set()
+        # the last hit list page listed, and the number of records still
+        # to fetch from each page, per landskap
+        self.listed = {}
+        self.pending = defaultdict(Counter)
+
+        # First request to get session cookie. Every landskap gets its own
+        # ASP.NET session (and cookiejar), since the server keeps the
+        # search and the current hit list page in the session, so the
+        # searches can paginate in parallel.
+        for landscape in self.landscapes:
+            yield scrapy.Request(
+                self.start_urls[0],
+                headers=self.headers,
+                callback=self.handle_initial_cookies,
+                meta={"landscape": landscape, "cookiejar": landscape},
+                dont_filter=True,
+            )
+
+    # A harvest only gets some of the fields of each record, so it keeps
+    # its own state per field set, e.g. crawlstate.instrument+namn.json,
+    # and a full crawl still fetches the records it has harvested
+    def state_path(self):
+        path = self.settings.get("CRAWL_STATE_PATH")
+        if self.fields is None:
+            return path
+        root, ext = os.path.splitext(path)
+        return f"{root}.{'+'.join(sorted(self.fields))}{ext}"
 
     def handle_initial_cookies(self, response):
         # Get cookies from response
@@ -81,119 +153,224 @@ class VisarkivSpider(scrapy.Spider):
                     session_cookies[".ASPXANONYMOUS"] = anon_id.group(1)
 
         # Now start the actual scraping with the session cookies
-        for landscape in self.landscapes:
-            formdata = {
-                "__EVENTTARGET": "",
-                "__EVENTARGUMENT": "",
-                "__VIEWSTATE": response.css("#__VIEWSTATE::attr(value)").get(),
-                "__VIEWSTATEGENERATOR": response.css(
-                    "#__VIEWSTATEGENERATOR::attr(value)"
-                ).get(),
-                "__PREVIOUSPAGE": response.css("#__PREVIOUSPAGE::attr(value)").get(),
-                "ctl00$cphContent$WebUserControl1$SOKLSK;30": "find xrlsk " + landscape,
-                "ctl00$cphContent$WebUserControl1$btnSearch": "Sök",
-            }
+        landscape = response.meta["landscape"]
+        formdata = {
+            "__EVENTTARGET": "",
+            "__EVENTARGUMENT": "",
+            "__VIEWSTATE": response.css("#__VIEWSTATE::attr(value)").get(),
+            "__VIEWSTATEGENERATOR": response.css(
+                "#__VIEWSTATEGENERATOR::attr(value)"
+            ).get(),
+            "__PREVIOUSPAGE": response.css("#__PREVIOUSPAGE::attr(value)").get(),
+            "ctl00$cphContent$WebUserControl1$SOKLSK;30": "find xrlsk " + landscape,
+            "ctl00$cphContent$WebUserControl1$btnSearch": "Sök",
+        }
 
-            headers = self.headers.copy()
-            headers["Referer"] = response.url
+        headers = self.headers.copy()
+        headers["Referer"] = response.url
 
-            yield scrapy.FormRequest(
-                "https://katalog.visarkiv.se/lib/views/rec/HitList.aspx",
-                formdata=formdata,
-                headers=headers,
-                cookies=session_cookies,
-                callback=self.parse_results,
-                meta={"landscape": landscape, "cookies": session_cookies, "page": 1},
-                dont_filter=True,
-            )
+        yield scrapy.FormRequest(
+            f"{self.base_url}/lib/views/rec/HitList.aspx",
+            formdata=formdata,
+            headers=headers,
+            cookies=session_cookies,
+            callback=self.parse_results,
+            meta={
+                "landscape": landscape,
+                "cookiejar": landscape,
+                "cookies": session_cookies,
+                "page": 1,
+            },
+            dont_filter=True,
+        )
 
     def parse_results(self, response):
-        meta = response.meta
-        print(f"***** Landskap: {meta['landscape']}, sida: {meta['page']}")
+        meta = {
+            key: response.meta[key]
+            for key in ("landscape", "cookiejar", "cookies", "page")
+        }
+        landscape = meta["landscape"]
+        state = self.state.landscape(landscape)
+        print(f"***** Landskap: {landscape}, sida: {meta['page']}")
 
-        # Extract links to individual records
-        record_links = (
-            response.css(
-                'tr.row td:first-child a[href*="ShowRecord.aspx?hit="], tr.alternaterow td:first-child a[href*="ShowRecord.aspx?hit="]'
-            )
-            .xpath("@href")
-            .getall()
+        # "Visar 1 - 20 av 94"
+        info = response.css("#ctl00_cphContent_lblResultInfo::text").re_first(
+            r"av (\d+)"
         )
+        total = int(info) if info else None
+
+        page_size, max_page_size = self.page_sizes(response)
+
+        if meta["page"] == 1 and not response.meta.get("resumed"):
+            if total != state["total"]:
+                # new or removed records can be on any page
+                state.update(page=1, total=total, done=False)
+            elif state["done"]:
+                self.logger.info(f"{landscape}: {total} hits, unchanged, skipping")
+                return
+
+            # Ask for as many hits per page as the server allows, which
+            # takes us back to page 1
+            if page_size < max_page_size:
+                yield self.page_request(response, 1, page_size=max_page_size)
+                return
+
+            if state["page"] > 1:
+                if state.get("page_size") == page_size:
+                    self.logger.info(
+                        f"{landscape}: resuming at page {state['page']}"
+                    )
+                    yield self.page_request(response, state["page"], resumed=True)
+                    return
+                # pages of another size, start over
+                state["page"] = 1
+
+        state["page_size"] = page_size
+
+        # Follow each record link that hasn't been harvested before, with
+        # high priority, or take the item straight from the hit list
+        for i, (link, hit) in enumerate(parse_hit_list(response.selector.root)):
+            accessionsnummer = hit["accessionsnummer"]
+            if self.state.is_seen(accessionsnummer):
+                self.crawler.stats.inc_value("crawlstate/skipped")
+                continue
 
-        # Follow each record link with high priority
-        for i, link in enumerate(record_links):
             full_url = urljoin(response.url, link)
+            if self.from_hit_list:
+                self.state.mark_seen(accessionsnummer, full_url)
+                yield self.select_fields(
+                    {"landscape_search": landscape, **hit, "url": full_url}
+                )
+                continue
+
             headers = self.headers.copy()
             headers["Referer"] = response.url
 
-            meta["result_index"] = i
+            self.pending[landscape][meta["page"]] += 1
             yield scrapy.Request(
                 full_url,
                 headers=headers,
                 cookies=meta["cookies"],
                 callback=self.parse_record,
-                meta=meta,
+                meta={
+                    **meta,
+                    "result_index": i,
+                    "accessionsnummer": accessionsnummer,
+                },
                 priority=100,
                 dont_filter=True,
                 errback=self.handle_error,
             )
 
+        # The state is saved by VisarkivPipeline once the records marked
+        # seen are in the store, and when the crawl closes
+        self.listed[landscape] = meta["page"]
+        self.update_page(landscape)
+
         # Check for next page
         next_link = response.css(
             "a#ctl00_cphContent_lblNextBottom:not([disabled])::attr(href)"
         ).get()
 
         if next_link:
-            # Get the current URL parameters
-            current_url = response.url
-            viewname = None
-            s_param = None
-
-            if "viewname=" in current_url:
-                viewname = re.search(r"viewname=([^&]+)", current_url).group(1)
-            if "s=" in current_url:
-                s_param = re.search(r"s=(\d+)_\d+", current_url).group(1)
-
-            # Prepare form data
-            formdata = {
-                "__EVENTTARGET": "ctl00$cphContent$lblNextBottom",
-                "__EVENTARGUMENT": "",
-                "__LASTFOCUS": "",
-                "__VIEWSTATE": response.css("#__VIEWSTATE::attr(value)").get(),
-                "__VIEWSTATEGENERATOR": response.css(
-                    "#__VIEWSTATEGENERATOR::attr(value)"
-                ).get(),
-                "ctl00$cphContent$HiddenHitsPerPage": "Empty",
-                "ctl00$cphContent$HiddenRefine": "Empty",
-                "ctl00$cphContent$ddSort": "_Default",
-                "ctl00$cphContent$txtGo": str(meta["page"]),
-                "ctl00$cphContent$ddDisplayHits": "20",
-                "ctl00$cphContent$txtGo2": str(meta["page"]),
-            }
+            yield self.page_request(response, meta["page"] + 1)
+        else:
+            self.finished.add(landscape)
 
-            headers = self.headers.copy()
-            headers["Referer"] = response.url
+    # The page to resume from is the first one with records that haven't
+    # been fetched yet, so nothing is lost when a crawl is interrupted
+    # with record requests still in the queue.
+    def update_page(self, landscape):
+        pending = +self.pending[landscape]
+        page = min(pending) if pending else self.listed[landscape]
+        self.state.landscape(landscape)["page"] = page
 
-            # Construct the URL for the next page request
-            next_url = "https://katalog.visarkiv.se/lib/views/rec/HitList.aspx"
-            if viewname:
-                next_url += f"?viewname={viewname}"
-            if s_param:
-                next_url += f"{'&' if viewname else '?'}s={s_param}_1"
+    def page_sizes(self, response):
+        # the hits per page, and the largest number the server allows
+        select = response.css('select[name="ctl00$cphContent$ddDisplayHits"]')
+        sizes = [int(v) for v in select.css("option::attr(value)").getall()]
+        selected = select.css("option[selected]::attr(value)").get()
+        page_size = int(selected) if selected else 20
+        return page_size, max(sizes, default=page_size)
 
-            meta["page"] += 1
+    def page_request(self, response, page, resumed=False, page_size=None):
+        meta = {
+            key: response.meta[key]
+            for key in ("landscape", "cookiejar", "cookies", "page")
+        }
+        current = meta["page"]
+        current_size = self.page_sizes(response)[0]
+        page_size = page_size or current_size
 
-            yield scrapy.FormRequest(
-                next_url,
-                formdata=formdata,
-                headers=headers,
-                cookies=meta["cookies"],
-                callback=self.parse_results,
-                meta=meta,
-                priority=50,
-                dont_filter=True,
-                errback=self.handle_error,
-            )
+        # Prepare form data. The next page is a postback from the "next"
+        # link, any other page goes through the page number box, and a
+        # new page size is a postback from its dropdown.
+        formdata = {
+            "__EVENTTARGET": "",
+            "__EVENTARGUMENT": "",
+            "__LASTFOCUS": "",
+            "__VIEWSTATE": response.css("#__VIEWSTATE::attr(value)").get(),
+            "__VIEWSTATEGENERATOR": response.css(
+                "#__VIEWSTATEGENERATOR::attr(value)"
+            ).get(),
+            "ctl00$cphContent$HiddenHitsPerPage": "Empty",
+            "ctl00$cphContent$HiddenRefine": "Empty",
+            "ctl00$cphContent$ddSort": "_Default",
+            "ctl00$cphContent$txtGo": str(current),
+            "ctl00$cphContent$ddDisplayHits": str(page_size),
+            "ctl00$cphContent$txtGo2": str(current),
+        }
+        if page_size != current_size:
+            formdata["__EVENTTARGET"] = "ctl00$cphContent$ddDisplayHits"
+            formdata["ctl00$cphContent$HiddenHitsPerPage"] = str(page_size)
+        elif page == current + 1:
+            formdata["__EVENTTARGET"] = "ctl00$cphContent$lblNextBottom"
+        else:
+            formdata["ctl00$cphContent$txtGo"] = str(page)
+            formdata["ctl00$cphContent$btnGo"] = "Gå till"
+
+        headers = self.headers.copy()
+        headers["Referer"] = response.url
+
+        return scrapy.FormRequest(
+            self.next_url(response.url),
+            formdata=formdata,
+            headers=headers,
+            cookies=meta["cookies"],
+            callback=self.parse_results,
+            meta={**meta, "page": page, "resumed": resumed},
+            priority=50,
+            dont_filter=True,
+            errback=self.handle_error,
+        )
+
+    def next_url(self, current_url):
+        # Get the current URL parameters
+        viewname = None
+        s_param = None
+
+        if "viewname=" in current_url:
+            viewname = re.search(r"viewname=([^&]+)", current_url).group(1)
+        if "s=" in current_url:
+            s_param = re.search(r"s=(\d+)_\d+", current_url).group(1)
+
+        # Construct the URL for the next page request
+        next_url = f"{self.base_url}/lib/views/rec/HitList.aspx"
+        if viewname:
+            next_url += f"?viewname={viewname}"
+        if s_param:
+            next_url += f"{'&' if viewname else '?'}s={s_param}_1"
+        return next_url
+
+    def closed(self, reason):
+        # A landskap is only done once all of its records have been
+        # fetched too. Records that failed or came back as another record
+        # are still pending, and the landskap resumes at their page.
+        if reason == "finished":
+            for landscape in self.finished:
+                if not +self.pending[landscape]:
+                    self.state.landscape(landscape)["done"] = True
+        self.state.save()
 
     def handle_error(self, failure):
         # Log the error and potentially retry the request
@@ -207,31 +384,41 @@ class VisarkivSpider(scrapy.Spider):
             self.logger.error(f"Error on {request.url}: {failure.value}")
 
     def parse_record(self, response):
-        def extract_field(fieldname):
-            selector = f'tr[id="{fieldname}"] td.fieldContents div::text'
-            return "".join(response.css(selector).getall()).strip()
-
-        media_url = response.css('tr[id="XRMED"] audio::attr(src)').get()
+        fields, media_url = parse_record_table(response.selector.root)
 
         record = {
             "landscape_search": response.meta.get("landscape"),
-            "accessionsnummer": extract_field("XRACC"),
+            "accessionsnummer": fields.pop("accessionsnummer"),
             "media_url": media_url,
-            "namn": extract_field("XRNAMN"),
-            "instrument": extract_field("XRINS"),
-            "ort": extract_field("XRORT"),
-            "landskap": extract_field("XRLSK"),
-            "spelplats": extract_field("XRSPL"),
-            "datum": extract_field("XRDATUM"),
-            "innehall": extract_field("XRIHL"),
-            "dokumentor": extract_field("XRDOK"),
-            "duration": extract_field("XRDUR"),
-            "inspelningsformat": extract_field("XRIFO"),
+            **fields,
             "url": response.url,
         }
+        record = self.select_fields(record)
+        landscape = response.meta["landscape"]
 
+        # the hit list's accessionsnummer is what's checked on re-crawls,
+        # so a page showing another record (the hit numbers belong to the
+        # session's current search) leaves the hit unfetched
+        accessionsnummer = response.meta.get("accessionsnummer")
+        if accessionsnummer and record["accessionsnummer"] != accessionsnummer:
+            self.logger.warning(
+                f"{landscape}: {response.url} shows {record['accessionsnummer']},"
+                f" expected {accessionsnummer}"
+            )
+            self.crawler.stats.inc_value("crawlstate/mismatched")
+            return
+        if accessionsnummer:
+            self.state.mark_seen(accessionsnummer, response.url)
+        self.pending[landscape][response.meta["page"]] -= 1
+        self.update_page(landscape)
         yield record
 
+    def select_fields(self, record):
+        if self.fields is None:
+            return record
+        keep = {"landscape_search", "accessionsnummer", "url", *self.fields}
+        return {key: value for key, value in record.items() if key in keep}
+
     custom_settings = {
         "SCRAPY_DEBUG": True,
         "COOKIES_ENABLED": True,
@@ -0,0 +1,145 @@
+import argparse
+import json
+import sqlite3
+import time
+
+# columns of the records table, in item order
+FIELDS = [
+    "accessionsnummer",
+    "landscape_search",
+    "media_url",
+    "namn",
+    "instrument",
+    "ort",
+    "landskap",
+    "spelplats",
+    "datum",
+    "innehall",
+    "dokumentor",
+    "duration",
+    "inspelningsformat",
+    "url",
+]
+
+INDEXED = ["landskap", "namn", "instrument", "datum"]
+
+
+# Scraped records, one row per accessionsnummer, in a SQLite database in
+# WAL mode so that it can be read while the spider writes to it:
+#
+#   store = RecordStore("records.db")
+#   store.find(landskap="Dalsland", instrument="fiol")
+#   store.search("innehall", "polska")
+class RecordStore:
+    def __init__(self, path="records.db"):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        columns = ",\n".join(f"{name} TEXT" for name in FIELDS[1:])
+        self.conn.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS records (
+                accessionsnummer TEXT PRIMARY KEY,
+                {columns},
+                scraped REAL NOT NULL
+            )
+            """
+        )
+        for name in INDEXED:
+            self.conn.execute(
+                f"CREATE INDEX IF NOT EXISTS records_{name} ON records ({name})"
+            )
+        self.conn.commit()
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM records").fetchone()[0]
+
+    def __contains__(self, accessionsnummer):
+        row = self.conn.execute(
+            "SELECT 1 FROM records WHERE accessionsnummer = ?", (accessionsnummer,)
+        ).fetchone()
+        return row is not None
+
+    def accessionsnummer(self):
+        rows = self.conn.execute("SELECT accessionsnummer FROM records")
+        return {row[0] for row in rows}
+
+    # The fields each stored record has a value for
+    def filled(self):
+        rows = self.conn.execute(f"SELECT {', '.join(FIELDS)} FROM records")
+        return {
+            row[0]: {name for name in FIELDS if row[name] is not None}
+            for row in rows
+        }
+
+    # One transaction per batch. A record that's already in the store only
+    # gets the fields it doesn't have yet, e.g. the media_url of a record
+    # that was harvested from the hit list.
+    def put_many(self, records, scraped=None):
+        scraped = time.time() if scraped is None else scraped
+        placeholders = ", ".join("?" * (len(FIELDS) + 1))
+        updates = ", ".join(
+            f"{name} = COALESCE(records.{name}, excluded.{name})"
+            for name in FIELDS[1:]
+        )
+        with self.conn:
+            self.conn.executemany(
+                f"""
+                INSERT INTO records ({", ".join(FIELDS)}, scraped)
+                VALUES ({placeholders})
+                ON CONFLICT (accessionsnummer) DO UPDATE SET {updates}
+                """,
+                [[r.get(name) for name in FIELDS] + [scraped] for r in records],
+            )
+
+    def find(self, **fields):
+        for name in fields:
+            if name not in FIELDS:
+                raise ValueError(f"Unknown field: {name}")
+        where = " AND ".join(f"{name} = ?" for name in fields) or "1"
+        rows = self.conn.execute(
+            f"SELECT {', '.join(FIELDS)} FROM records WHERE {where}"
+            " ORDER BY accessionsnummer",
+            list(fields.values()),
+        )
+        return [dict(row) for row in rows]
+
+    def search(self, field, text):
+        if field not in FIELDS:
+            raise ValueError(f"Unknown field: {field}")
+        rows = self.conn.execute(
+            f"SELECT {', '.join(FIELDS)} FROM records WHERE {field} LIKE ?"
+            " ORDER BY accessionsnummer",
+            (f"%{text}%",),
+        )
+        return [dict(row) for row in rows]
+
+    def close(self):
+        self.conn.close()
+
+
+# Prints matching records as JSON lines:
+#
+#   python -m visarkiv.store --db records.db landskap=Dalsland
+#   python -m visarkiv.store --search innehall=polska
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db", default="records.db")
+    parser.add_argument("--search", metavar="FIELD=TEXT")
+    parser.add_argument("where", nargs="*", metavar="FIELD=VALUE")
+    args = parser.parse_args()
+
+    store = RecordStore(args.db)
+    if args.search:
+        field, text = args.search.split("=", 1)
+        records = store.search(field, text)
+    else:
+        records = store.find(**dict(w.split("=", 1) for w in args.where))
+    for record in records:
+        print(json.dumps(record, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()